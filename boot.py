@@ -1,4 +1,18 @@
 # SPDX-License-Identifier: MIT
+from board import A0
+from digitalio import DigitalInOut, Direction, Pull
+import storage
 import usb_hid
 
 usb_hid.disable()
+
+# Unless the A0 admin mode jumper is grounded, make CIRCUITPY writable by
+# code so the logger can spill its log to flash. USB can't write to the drive
+# then, but the board is in deep sleep (no USB) for most of that time anyway.
+# Grounding A0 wakes the board, which runs this again and leaves the drive
+# writable over USB for downloading logs and updating code.
+with DigitalInOut(A0) as a0_gnd:
+    a0_gnd.direction = Direction.INPUT
+    a0_gnd.pull = Pull.UP
+    if a0_gnd.value:
+        storage.remount('/', readonly=False)
@@ -10,24 +10,65 @@ CircuitPython library bundle zip files get cached in ~/.cache/circuitpython/
 
 To customize the contents of your project bundle, edit bundle_manifest.cfg
 according to the comments in that file.
+
+With --mpy, the project's own modules (the [root] .py files other than code.py
+and boot.py) get compiled to .mpy with mpy-cross, which saves the ESP32 from
+compiling them from source on every wake from deep sleep. This needs the
+CircuitPython 9.x build of mpy-cross on your PATH. Without it, the bundle gets
+the .py sources as usual.
 """
+import argparse
 from configparser import ConfigParser
+from hashlib import sha256
 import os
 import os.path
 from os.path import abspath, basename, expanduser, isdir, isfile
 import re
 import shutil
 import subprocess
-from zipfile import ZipFile
+import sys
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
 
 MANIFEST = 'bundle_manifest.cfg'
 CACHE_DIR = abspath(expanduser('~/.cache/circuitpython'))
 
+# Fixed timestamp for zip archive members, so unchanged inputs make a byte for
+# byte identical zip file (the zip format can't go earlier than 1980)
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# CircuitPython runs these by name, so they can't be compiled to .mpy
+NO_MPY = ('code.py', 'boot.py')
+
 def run(cmd):
     result = subprocess.run(cmd, shell=True, check=True, capture_output=True)
     return result.stdout.decode('utf-8').strip()
 
+def walk_files(path):
+    # Return sorted list of file paths for a file or a directory tree
+    if isfile(path):
+        return [path]
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        dirnames.sort()
+        found.extend(os.path.join(dirpath, f) for f in sorted(filenames))
+    return found
+
+ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+ap.add_argument('--mpy', action='store_true',
+                help='compile project modules to .mpy with mpy-cross')
+args = ap.parse_args()
+
+# Find mpy-cross if it was asked for, noting its version for the README
+mpy_cross = None
+mpy_version = None
+if args.mpy:
+    mpy_cross = shutil.which('mpy-cross')
+    if mpy_cross:
+        mpy_version = run(f'"{mpy_cross}" --version')
+    else:
+        print("WARNING: mpy-cross not found, using .py sources")
+
 # Read the bundle manifest file
 config = ConfigParser(allow_no_value=True)
 config.read(MANIFEST)
@@ -51,6 +92,7 @@ except subprocess.CalledProcessError:
 # prepare file and directory paths
 files = {
     'zip':    os.path.join('build', f'{repo_name}-{commit}.zip'),
+    'stamp':  os.path.join('build', f'{repo_name}.stamp'),
     'readme': os.path.join('build', repo_name, 'README.txt'),
 }
 dirs = {
@@ -60,7 +102,31 @@ dirs = {
     '9_lib':  os.path.join('build', repo_name, 'CircuitPython 9.x', 'lib'),
 }
 
-# Create the directory tree of the zip archive and downloads cache
+# Fingerprint all the inputs. If they match the last build and its zip file
+# is still there, the bundle is already up to date. (`make sync` runs this on
+# every iteration, so skipping the work matters.)
+for src in cfg['root']:
+    if not (isfile(src) or isdir(src)):
+        raise FileNotFoundError(src)
+h = sha256()
+for meta in (repo_name, commit, git_remote, mpy_version or ''):
+    h.update(meta.encode('utf-8') + b'\0')
+for path in [__file__, MANIFEST] + cfg['root']:
+    for f in walk_files(path):
+        h.update(f.encode('utf-8') + b'\0')
+        with open(f, 'rb') as f_src:
+            h.update(sha256(f_src.read()).digest())
+fingerprint = h.hexdigest()
+if isfile(files['zip']) and isfile(files['stamp']) and isdir(dirs['root']):
+    with open(files['stamp']) as f:
+        if f.read().strip() == fingerprint:
+            print("up to date:", files['zip'])
+            sys.exit(0)
+
+# Start the zip archive directory tree fresh, so files removed from the
+# manifest don't linger, and create the downloads cache
+if isdir(dirs['root']):
+    shutil.rmtree(dirs['root'])
 for d in dirs.values():
     if not isdir(d):
         os.makedirs(d)
@@ -70,10 +136,26 @@ for src in cfg['root']:
     dst = dirs['9.x']
     if isfile(src):
         shutil.copy2(src, dst)
-    elif isdir(src):
-        shutil.copytree(src, os.path.join(dst, basename(src)))
     else:
-        raise FileNotFoundError(src)
+        shutil.copytree(src, os.path.join(dst, basename(src)),
+                        dirs_exist_ok=True)
+
+# Compile project modules to .mpy, keeping the .py source for any module that
+# fails to compile
+compiled = []
+if mpy_cross:
+    for src in cfg['root']:
+        if not (isfile(src) and src.endswith('.py')) or src in NO_MPY:
+            continue
+        staged = os.path.join(dirs['9.x'], basename(src))
+        try:
+            run(f'"{mpy_cross}" -o "{staged[:-3]}.mpy" "{src}"')
+        except subprocess.CalledProcessError as e:
+            print(f"WARNING: mpy-cross failed for {src}, using .py source")
+            print(e.stderr.decode('utf-8').strip())
+            continue
+        os.remove(staged)
+        compiled.append(basename(src))
 
 # Download library bundle archives with curl, use cache for local testing
 url9 = cfg['9.x']
@@ -88,22 +170,25 @@ if not isfile(zip9path):
 # potentially many .mpy files.
 def extract_libs(zip_path, dst_dir, lib_names):
     zf = ZipFile(zip_path)
-    info_list = zf.infolist()
-    # Step 1: find the source files (might be nested in a directory)
+    # Step 1: index the archive members by library name in one pass.
     # For archive member paths like ".../lib/NAME.mpy" or ".../lib/NAME/...",
     # this regular expression should capture just the "NAME" part, which should
     # be a library name.
     lib_re = re.compile(r'^[^/]*/lib/(?:([^/]*).mpy|([^/]*)/)')
-    src_items = []
-    for i in info_list:
+    index = {}
+    for i in zf.infolist():
         result = lib_re.match(i.filename)
         if result:
-            captured_name = result[1] or result[2]
-            for lib in lib_names:
-                if lib == captured_name:
-                    src_items.append(i)
+            index.setdefault(result[1] or result[2], []).append(i)
+    src_items = []
+    for lib in lib_names:
+        if lib not in index:
+            print("WARNING: library not found in bundle:", lib)
+        src_items.extend(index.get(lib, []))
     # Step 2: extract the matching files to the destination path ('.../lib/')
     for i in src_items:
+        if i.is_dir():
+            continue
         # The split > slice > join here is to remove the first two directories
         # from filenames inside the zip archive. For example, starting with
         # "adafruit-circuitpython-bundle-9.x-mpy-20240625/lib/adafruit_midi/note_on.mpy",
@@ -119,7 +204,18 @@ def extract_libs(zip_path, dst_dir, lib_names):
             with open(dst_path, 'wb') as f_dst:
                 f_dst.write(f_src.read())
 
-extract_libs(zip9path, dirs['9_lib'], cfg['lib'])
+# Extracted libraries get cached by bundle zip name and library list, so the
+# big bundle zip only gets opened when one of those changes
+lib_key = sha256('\n'.join(sorted(cfg['lib'])).encode('utf-8')).hexdigest()
+lib_cache = os.path.join(
+    cache, 'libs', basename(url9).removesuffix('.zip') + '-' + lib_key[:12])
+if not isfile(os.path.join(lib_cache, '.complete')):
+    if isdir(lib_cache):
+        shutil.rmtree(lib_cache)
+    extract_libs(zip9path, lib_cache, cfg['lib'])
+    open(os.path.join(lib_cache, '.complete'), 'w').close()
+shutil.copytree(lib_cache, dirs['9_lib'], dirs_exist_ok=True,
+                ignore=shutil.ignore_patterns('.complete'))
 
 # Generate the README file
 readme = f"""
@@ -134,11 +230,51 @@ Libraries in '{repo_name}/CircuitPython 9.x/lib' came from:
 The rest of this project's code is from commit {commit} of git repo:
 {git_remote}
 """.strip()
+if compiled:
+    readme += f"""
+
+These modules were compiled to .mpy files with {mpy_version}:
+{', '.join(compiled)}
+If you copy this bundle over an older one, delete any .py files with the same
+names from CIRCUITPY, because CircuitPython imports .py files first."""
 with open(files['readme'], 'w') as f:
     print(readme, file=f)
 
-# Make the zip file
-run(f"cd build; zip -r {basename(files['zip'])} {basename(dirs['root'])}")
+# Make the zip file. Members go in sorted order with fixed timestamps and
+# permissions, so the same inputs always make the same zip file.
+def zip_tree(zip_path, root_dir):
+    base = os.path.dirname(root_dir)
+    members = []
+    for (dirpath, dirnames, filenames) in os.walk(root_dir):
+        dirnames.sort()
+        arc_dir = os.path.relpath(dirpath, base).replace(os.sep, '/')
+        members.append((arc_dir + '/', None))
+        for name in sorted(filenames):
+            members.append((arc_dir + '/' + name, os.path.join(dirpath, name)))
+    with ZipFile(zip_path, 'w', ZIP_DEFLATED) as zf:
+        for (arcname, path) in members:
+            info = ZipInfo(arcname, date_time=ZIP_DATE_TIME)
+            if path is None:
+                info.external_attr = (0o40755 << 16) | 0x10
+                zf.writestr(info, b'')
+            else:
+                info.external_attr = 0o100644 << 16
+                info.compress_type = ZIP_DEFLATED
+                with open(path, 'rb') as f:
+                    zf.writestr(info, f.read())
+    return zip_path
+
+zip_tree(files['zip'], dirs['root'])
+with open(files['stamp'], 'w') as f:
+    print(fingerprint, file=f)
 
-# Print an unzip listing for the Actions workflow log
-print(run(f"unzip -l {files['zip']}"))
+# Print a listing of the zip file for the Actions workflow log
+with ZipFile(files['zip']) as zf:
+    infos = zf.infolist()
+    print(f"Archive:  {files['zip']}")
+    print("  Length  Name")
+    print("--------  ----")
+    for i in infos:
+        print(f"{i.file_size:8d}  {i.filename}")
+    print("--------  ----")
+    print(f"{sum(i.file_size for i in infos):8d}  {len(infos)} files")
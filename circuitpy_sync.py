@@ -0,0 +1,174 @@
+# SPDX-License-Identifier: MIT
+"""
+Copy a staged project bundle to one or more CIRCUITPY drives, writing only
+the files that changed.
+
+This is what `make sync` runs after `make bundle`. It works on macOS and
+Linux. With no mount paths, it looks for mounted CIRCUITPY drives in the
+usual places (/Volumes, /media/$USER, /run/media/$USER).
+
+    python3 circuitpy_sync.py [MOUNT ...] [--src DIR] [--force] [--dry-run]
+
+For each board, a manifest of the SHA-256 hash, size, and modification time
+of every file written gets saved in ~/.cache/circuitpython/sync/, keyed by the
+board UID from boot_out.txt. A file is only written when its hash differs from
+the manifest, or when the file on the board no longer matches the manifest's
+size and time (then its hash gets checked). That way, flash gets written as
+little as possible, and CircuitPython auto-reloads less.
+
+Files get written in a safe order: libraries, then project modules, then
+boot.py, then code.py last, so the auto-reload that follows a write to code.py
+finds everything it imports already in place.
+"""
+import argparse
+from glob import glob
+from hashlib import sha256
+import json
+import os
+import os.path
+from os.path import abspath, expanduser, isdir, isfile
+import re
+import subprocess
+import sys
+from time import perf_counter
+
+
+CACHE_DIR = abspath(expanduser('~/.cache/circuitpython/sync'))
+
+# Where CIRCUITPY drives get mounted on macOS and Linux
+MOUNT_GLOBS = (
+    '/Volumes/CIRCUITPY*',
+    '/media/*/CIRCUITPY*',
+    '/run/media/*/CIRCUITPY*',
+)
+
+def default_src():
+    # Staging directory made by bundle_builder.py for this repo
+    top = subprocess.run(
+        'git rev-parse --show-toplevel', shell=True, check=True,
+        capture_output=True).stdout.decode('utf-8').strip()
+    return os.path.join('build', os.path.basename(top), 'CircuitPython 9.x')
+
+def staged_files(src):
+    # Return sorted list of relative paths for all files under src
+    found = []
+    for (dirpath, dirnames, filenames) in os.walk(src):
+        dirnames.sort()
+        for f in sorted(filenames):
+            rel = os.path.relpath(os.path.join(dirpath, f), src)
+            found.append(rel.replace(os.sep, '/'))
+    return found
+
+def write_order(rel):
+    # Sort key for the safe write order: lib/ first, code.py last
+    if rel.startswith('lib/'):
+        return (0, rel)
+    if rel == 'boot.py':
+        return (2, rel)
+    if rel == 'code.py':
+        return (3, rel)
+    return (1, rel)
+
+def board_uid(mount):
+    # Read the board UID from boot_out.txt, falling back to the mount path
+    try:
+        with open(os.path.join(mount, 'boot_out.txt')) as f:
+            m = re.search(r'^UID:(\S+)', f.read(), re.M)
+            if m:
+                return m[1]
+    except OSError:
+        pass
+    return re.sub(r'[^\w.-]', '_', abspath(mount))
+
+def file_hash(path):
+    with open(path, 'rb') as f:
+        return sha256(f.read()).hexdigest()
+
+def sync_board(src, mount, files, force=False, dry_run=False):
+    # Bring one CIRCUITPY drive up to date. Returns (files written, bytes
+    # written, files unchanged).
+    manifest_path = os.path.join(CACHE_DIR, board_uid(mount) + '.json')
+    manifest = {}
+    if isfile(manifest_path) and not force:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    (written, nbytes, same) = (0, 0, 0)
+    for rel in files:
+        with open(os.path.join(src, rel), 'rb') as f:
+            data = f.read()
+        digest = sha256(data).hexdigest()
+        dst = os.path.join(mount, rel)
+        old = manifest.get(rel)
+        try:
+            st = os.stat(dst)
+        except OSError:
+            st = None
+        if st is not None and old is not None and old[0] == digest:
+            if [st.st_size, st.st_mtime_ns] == old[1:]:
+                same += 1
+                continue
+        if st is not None and st.st_size == len(data):
+            # Not in the manifest, or changed on the board since. Reading is
+            # much cheaper than writing flash, so check before writing.
+            if file_hash(dst) == digest:
+                manifest[rel] = [digest, st.st_size, st.st_mtime_ns]
+                same += 1
+                continue
+        print('  %s (%d bytes)' % (rel, len(data)))
+        written += 1
+        nbytes += len(data)
+        if dry_run:
+            continue
+        os.makedirs(os.path.dirname(dst) or mount, exist_ok=True)
+        with open(dst, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        st = os.stat(dst)
+        manifest[rel] = [digest, st.st_size, st.st_mtime_ns]
+    # A .py file on the board would get imported instead of a new .mpy
+    for rel in files:
+        shadow = rel[:-4] + '.py'
+        if (rel.endswith('.mpy') and shadow not in files
+                and isfile(os.path.join(mount, shadow))):
+            print('  removing %s (shadows %s)' % (shadow, rel))
+            manifest.pop(shadow, None)
+            if not dry_run:
+                os.remove(os.path.join(mount, shadow))
+    if not dry_run:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.sync()
+    return (written, nbytes, same)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('mounts', nargs='*', metavar='MOUNT',
+                    help='CIRCUITPY mount path(s) (default: find them)')
+    ap.add_argument('--src', help='staged bundle directory (default: '
+                    'build/<repo>/CircuitPython 9.x from make bundle)')
+    ap.add_argument('--force', action='store_true',
+                    help='ignore the saved manifests and compare every file')
+    ap.add_argument('--dry-run', action='store_true',
+                    help="list what would be written, but don't write it")
+    args = ap.parse_args()
+    src = args.src or default_src()
+    if not isdir(src):
+        sys.exit('ERROR: no staged bundle at %r (run make bundle)' % src)
+    mounts = args.mounts or sorted(set(
+        m for g in MOUNT_GLOBS for m in glob(g) if isdir(m)))
+    if not mounts:
+        sys.exit('ERROR: no CIRCUITPY drive found')
+    files = sorted(staged_files(src), key=write_order)
+    for mount in mounts:
+        t0 = perf_counter()
+        print('%s:' % mount)
+        (written, nbytes, same) = sync_board(
+            src, mount, files, args.force, args.dry_run)
+        print('  %d written (%d bytes), %d unchanged, %.1f s' % (
+            written, nbytes, same, perf_counter() - t0))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,7 @@
 # SPDX-License-Identifier: MIT
+from time import monotonic_ns
+T0 = monotonic_ns()  # start of the wake cycle, for PROFILE
+
 import alarm
 from alarm import (
     light_sleep_until_alarms, exit_and_deep_sleep_until_alarms
@@ -11,8 +14,11 @@ from micropython import const
 import time
 from time import monotonic, sleep
 
-from datalogger import battery_centivolts, temp_f
-from sleepmem import SleepMem
+from datalogger import (
+    NO_DATA, battery_centivolts, battery_finish, battery_start,
+    has_A3_divider, temp_finish, temp_start
+)
+from sleepmem import SPILL_FILE, SleepMem
 
 
 # The logging interval in seconds
@@ -27,6 +33,49 @@ LOW_CV = const(355)
 # Value to mark unavailable voltage measurement
 NONE_CV = const(270)
 
+# Measure the battery on every Nth wake, reusing the cached value from sleep
+# memory otherwise. Waking the MAX17048 costs about 0.5s of awake time, while
+# the battery only drops a few cV per day. (6 wakes is 2 hours at 20 minutes)
+# Boards that measure through the A3 divider take well under a millisecond,
+# so they measure on every wake.
+BATT_EVERY = const(6)
+
+# Measure on every wake once the last reading is this close to LOW_CV
+BATT_NEAR_CV = const(10)
+
+# Change-driven logging: sample on every wake, but only append a record when
+# some temperature moves by more than DEADBAND_F, the battery moves by more
+# than DEADBAND_CV, or MAX_GAP_S passes without a record. util.dump() fills
+# the skipped samples back in from the held values. With DEADBAND_F at 0,
+# only repeats of the same (whole degree) temperature get skipped, so the
+# filled-in temperatures are exact. Set MAX_GAP_S to 0 to log every sample.
+DEADBAND_F = const(0)
+DEADBAND_CV = const(2)
+MAX_GAP_S = const(60 * 60 * 3)
+
+# When the log fills up, overwrite the oldest records (1) rather than stop
+# logging (0). Takes effect for the next log started with util.set_clock().
+RING_BUFFER = const(0)
+
+# In admin mode, also blink the lowest and highest temperatures (°F) since
+# the log started after the battery voltage (1), or only the voltage (0).
+# Off by default, since it makes each message several times longer, which
+# means more LED on-time.
+MORSE_SUMMARY = const(0)
+
+# Once sleep memory holds this many full 64 byte blocks of log (about 55
+# samples each), move them to SPILL_FILE on the CIRCUITPY drive in one write.
+# That keeps flash writes rare, and the spilled part of the log survives a
+# flat battery. boot.py makes CIRCUITPY writable when A0 isn't jumpered. Set
+# this to 0 to keep the log in sleep memory only.
+SPILL_BLOCKS = const(32)
+
+# Time each phase of the wake cycle and keep last/min/mean/max stats in sleep
+# memory (1), or don't (0). The stats area takes 82 bytes from the end of the
+# log. Takes effect for the next log started with util.set_clock(). Print the
+# stats from the REPL with util.profile().
+PROFILE = const(0)
+
 
 def admin_mode(a0_gnd):
     # Admin mode pauses logging and adjusts sleep mode usage. The point is to
@@ -41,16 +90,24 @@ def admin_mode(a0_gnd):
     # Blink logger status in morse on the LED for as long as the A0 USB-mode
     # jumper is grounded and the battery is not too low.
     led = RedLED()
+    (msg, sched) = (None, None)
+    stats = ''
+    if MORSE_SUMMARY:
+        summary = SleepMem().summary
+        if summary[0]:
+            stats = '%d %d + ' % (summary[2], summary[4])
     while not a0_gnd.value:
         cV = battery_centivolts() or NONE_CV
         # Unless battery is low, send centi-Volts in Morse code on LED
         if cV and ((cV > LOW_CV) or (cV == NONE_CV)):
             gc.collect()
-            msg = '  ^ %d %d + ' % (cV, cV)
+            text = '  ^ %d %d + %s' % (cV, cV, stats)
+            if text != msg:
+                # Only recompile the Morse schedule when the message changes
+                (msg, sched) = (text, led.compile_morse(text))
             print(msg)
-            for c in msg:
-                if not a0_gnd.value:
-                    led.morse_char(c)
+            if not led.play(sched, a0_gnd):
+                break
         # Wait for a bit.
         # - When battery is above storage voltage, use time.sleep() to
         #   intentionally drain battery faster. This can be used to
@@ -71,6 +128,47 @@ def admin_mode(a0_gnd):
     led.value = False
     led.deinit()
 
+def battery_due(wakes, cV):
+    # Decide whether this wake should measure the battery (True) or reuse the
+    # cached cV (False). Measure every BATT_EVERY wakes, or on every wake
+    # when the cached value is close to LOW_CV or measuring is cheap.
+    return ((wakes % BATT_EVERY == 0) or (cV <= LOW_CV + BATT_NEAR_CV)
+            or has_A3_divider())
+
+def should_log(sm, timestamp, temps, cV):
+    # Decide whether this sample needs a record, or if it's close enough to
+    # the last logged one that util.dump() can fill it in. This uses the
+    # deadband settings saved in the log header, so a log started by older
+    # firmware (max gap of 0) keeps logging every sample.
+    (interval, max_gap) = sm.sampling
+    last = sm.last_logged()
+    if (not max_gap) or (last is None):
+        return True
+    (t0, temps0, cV0) = last
+    if timestamp - t0 >= max_gap - (interval >> 1):
+        return True
+    # Compare values the way they get stored: missing trailing probes get
+    # padded with NO_DATA, temperatures wrap to int8 (so NO_DATA reads back
+    # as -128), and failed or out of range battery readings read back as
+    # NONE_CV
+    n = len(temps0)
+    temps = list(temps[:n]) + [NO_DATA] * (n - len(temps))
+    temps = [((t + 128) & 0xFF) - 128 for t in temps]
+    if not (NONE_CV < cV < 430):
+        cV = NONE_CV
+    if abs(cV - cV0) > DEADBAND_CV:
+        return True
+    for (t, t_last) in zip(temps, temps0):
+        if abs(t - t_last) > DEADBAND_F:
+            return True
+    return False
+
+def light_sleep_until(t):
+    # Wait until time.monotonic() reaches t. Light sleep draws much less
+    # current than sleep(), and the sensors keep working in the meantime.
+    if t > monotonic():
+        light_sleep_until_alarms(TimeAlarm(monotonic_time=t))
+
 def main():
     # This will run each time the board wakes from deep sleep.
 
@@ -80,17 +178,61 @@ def main():
     with DigitalInOut(A0) as a0_gnd:
         a0_gnd.direction = Direction.INPUT
         a0_gnd.pull = Pull.UP
-        if not a0_gnd.value:
+        admin = not a0_gnd.value
+        if admin:
             admin_mode(a0_gnd)
+    if PROFILE:
+        marks = [T0, monotonic_ns()]
 
     # Normal temperature logging mode...
 
-    # Record a measurement
+    # Record a measurement. The DS18B20 conversion and the MAX17048 settling
+    # time both take a while, so start them both, light sleep until both are
+    # ready, then collect the results. That makes the awake time about the
+    # longer of the two waits rather than their sum.
     sm = SleepMem()
-    tempF = temp_f()
-    cV = battery_centivolts() or 0
-    print("DS18B20: %d °F, batt: %d cV" % (tempF, cV))
-    sm.append_data(time.time(), tempF, cV)
+    if sm.empty:
+        sm.sampling = (INTERVAL_S, MAX_GAP_S)
+        sm.ring = RING_BUFFER
+        sm.profiling = PROFILE
+    (wakes, cV) = sm.batt
+    due = battery_due(wakes, cV)
+    how = 'cached'
+    temp = temp_start(sm)
+    if PROFILE:
+        marks.append(monotonic_ns())
+    batt = battery_start() if due else None
+    if PROFILE:
+        marks.append(monotonic_ns())
+    light_sleep_until(max(temp[-1] if temp else 0, batt[-1] if batt else 0))
+    if PROFILE:
+        marks.append(monotonic_ns())
+    temps = temp_finish(temp, sm)
+    if PROFILE:
+        marks.append(monotonic_ns())
+    if due:
+        cV = battery_finish(batt) or 0
+        how = 'measured'
+    if PROFILE:
+        marks.append(monotonic_ns())
+    # Keep track of how stale the logged cV is, for util.summary()
+    sm.batt = (wakes + 1, cV, 0 if due else sm.batt_age + 1)
+    print("DS18B20: %s °F, batt: %d cV (%s)" % (
+        ', '.join(['%d' % t for t in temps]), cV, how))
+    now = time.time()
+    if should_log(sm, now, temps, cV):
+        sm.append_data(now, temps, cV)
+    else:
+        print("unchanged, not logged")
+        sm.summarize(now, temps[0], cV)
+    sm.seen = now
+    if SPILL_BLOCKS:
+        sm.spill(SPILL_FILE, SPILL_BLOCKS)
+    # Leave out wakes that went through admin mode, since their startup
+    # time includes however long the A0 jumper was on
+    if PROFILE and sm.profiling and not admin:
+        marks.append(monotonic_ns())
+        sm.add_profile(marks)
 
     # Do an ESP32 deep sleep to save battery power
     exit_and_deep_sleep_until_alarms(
@@ -1,12 +1,15 @@
 # SPDX-License-Identifier: MIT
-from board import board_id, A1, I2C
+from analogio import AnalogIn
+from board import board_id, A1, A3, I2C
 from digitalio import DigitalInOut
+from microcontroller import nvm
 from micropython import const
 from rtc import RTC
+from struct import pack, unpack
 import time
-from time import sleep
+from time import monotonic, sleep
 
-from adafruit_onewire.bus import OneWireBus
+from adafruit_onewire.bus import OneWireAddress, OneWireBus
 from adafruit_ds18x20 import DS18X20
 from adafruit_max1704x import MAX17048
 
@@ -17,6 +20,40 @@ NO_DATA = const(0x80)
 # Pin for the 1-wire bus
 ONEWIRE_PIN = A1
 
+# DS18B20 conversion resolution in bits. Conversion time is 94 ms at 9 bits
+# vs 750 ms at 12 bits, and 9 bits (0.5 °C) is plenty for integer °F.
+RESOLUTION = const(9)
+
+# Maximum DS18B20 conversion time (seconds) at RESOLUTION bits
+CONVERSION_S = 0.75 / (1 << (12 - RESOLUTION))
+
+# Time (seconds) for the MAX17048 to settle after wake() so that cell_voltage
+# reflects a fresh measurement
+MAX17_SETTLE_S = 0.5
+
+# QT Py boards measure the battery through a voltage divider from BAT to A3
+# (two equal resistors, 100 kΩ or more), so A3 sees half the battery voltage.
+# That keeps a full 4.2 V cell within the ADC's range.
+A3_DIVIDER = 2.0
+
+# Per-board calibration factor for the A3 measurement, to cancel out resistor
+# tolerance and ADC gain error. Each board keeps its own in microcontroller.nvm
+# (which make sync, util.set_clock(), and a flat battery all leave alone) at
+# offset A3_CAL_NVM: the tag A3_CAL_TAG, then the factor as a uint16 in units
+# of 1/10000. util.calibrate_batt() sets it. Without it, the factor is 1.0.
+A3_CAL_NVM = const(0)
+A3_CAL_TAG = b'A3'
+
+# Number of ADC reads averaged for one A3 measurement. Each read takes tens
+# of microseconds, and averaging several smooths out the ESP32-S3 ADC noise.
+A3_SAMPLES = const(16)
+
+# 1-wire Skip ROM + DS18B20 Convert T: start a conversion on every probe
+SKIP_ROM_CONVERT_T = b'\xCC\x44'
+
+# 1-wire Skip ROM + DS18B20 Write Scratchpad (followed by TH, TL, config)
+SKIP_ROM_WRITE_SCRATCH = b'\xCC\x4E'
+
 # Singleton for the 1-wire bus object to avoid pin in use errors
 _1WIRE = None
 
@@ -39,29 +76,161 @@ def battery_centivolts():
     # Return battery voltage (cV), or None if measurement is unavailable.
     # Note that 3.70V = 370cV, 4.19V = 419cV, etc. Using centi-Volts makes it
     # more convenient to send the voltage measurement in Morse code.
-    cV = None
+    pending = battery_start()
+    if pending:
+        sleep(max(0, pending[-1] - monotonic()))
+    return battery_finish(pending)
+
+def battery_start():
+    # Phase 1 of a split-phase battery measurement: wake the fuel gauge so it
+    # can settle while the caller does other work. Returns a pending tuple
+    # for battery_finish() whose last item is the time.monotonic() time when
+    # the reading will be ready, or None if measurement is unavailable.
     if has_max17():
-        with I2C() as i2c:
-            max17 = MAX17048(i2c)
-            max17.wake()
-            sleep(0.5)
-            cV = round(max17.cell_voltage * 100)
+        i2c = I2C()
+        max17 = MAX17048(i2c)
+        max17.wake()
+        return (i2c, max17, monotonic() + MAX17_SETTLE_S)
     elif has_A3_divider():
-        pass
+        # The ADC needs no settling time, so measure right away
+        return (a3_centivolts(), monotonic())
+    return None
+
+def battery_finish(pending):
+    # Phase 2 of a split-phase battery measurement: return battery voltage
+    # (cV), or None if measurement is unavailable
+    if not pending:
+        return None
+    if len(pending) == 2:
+        # A3 divider reading, already taken by battery_start()
+        return pending[0]
+    (i2c, max17, _) = pending
+    cV = round(max17.cell_voltage * 100)
+    i2c.deinit()
     return cV
 
-def temp_f():
-    # Return a temperature measurement in Fahrenheit (int8)
+def a3_calibration():
+    # Return this board's A3 calibration factor from nvm (1.0 if not set)
+    (tag, cal) = unpack('<2sH', nvm[A3_CAL_NVM:A3_CAL_NVM+4])
+    if (tag != A3_CAL_TAG) or not cal:
+        return 1.0
+    return cal / 10000
+
+def set_a3_calibration(cal):
+    # Save this board's A3 calibration factor to nvm
+    nvm[A3_CAL_NVM:A3_CAL_NVM+4] = pack('<2sH', A3_CAL_TAG, round(cal * 10000))
+
+def a3_centivolts(cal=None):
+    # Measure the battery voltage (cV) through the divider on A3, averaging
+    # a quick burst of A3_SAMPLES ADC reads. Uses the board's calibration
+    # factor unless cal is given.
+    if cal is None:
+        cal = a3_calibration()
+    with AnalogIn(A3) as adc:
+        total = 0
+        for _ in range(A3_SAMPLES):
+            total += adc.value
+        ref = adc.reference_voltage
+    # AnalogIn.value is scaled to 16 bits over 0..reference_voltage
+    return round(total * ref * A3_DIVIDER * cal * 100
+                 / (A3_SAMPLES * 65535))
+
+def valid_rom(rom):
+    # Is rom a DS18B20 1-wire ROM address with a good CRC? (True/False)
+    return rom[0] == 0x28 and OneWireBus.crc8(rom) == 0
+
+def find_ds18b20s(sm=None, rescan=False):
+    # Return a list of OneWireAddress for the DS18B20 probes, one per log
+    # column, with None for a column whose probe has gone missing. When a
+    # SleepMem is given, this uses the ROM addresses cached in sleep memory
+    # rather than scanning the bus (unless rescan is True).
     global _1WIRE
     if not _1WIRE:
         _1WIRE = OneWireBus(ONEWIRE_PIN)
-    # Loop over all devices on the 1-wire bus
-    F = NO_DATA
-    for d in _1WIRE.scan():
-        if d.family_code != 0x28:
-            # Skip devices that don't have the DS18B20 family code
-            continue
-        # Return temperature of first DS18B20, converting C to F
-        ds18b20 = DS18X20(_1WIRE, d)
-        F = round((ds18b20.temperature * 1.8) + 32)
-    return F
+    cached = sm.roms if sm else []
+    if any(valid_rom(r) for r in cached) and not rescan:
+        slots = [r if valid_rom(r) else None for r in cached]
+    else:
+        # Scan the bus. Probes that are still present keep their columns,
+        # and new probes fill empty columns, so a replaced probe takes over
+        # the column of the one it replaced.
+        found = [d.rom for d in _1WIRE.scan() if d.family_code == 0x28]
+        slots = [r if (valid_rom(r) and r in found) else None for r in cached]
+        new = [r for r in found if not (r in slots)]
+        for i in range(len(slots)):
+            if (slots[i] is None) and new:
+                slots[i] = new.pop(0)
+        if not sm:
+            slots = new
+        if found:
+            # Set the resolution of all the probes at once. They keep it
+            # while the board is in deep sleep, so this only happens here.
+            cfg = (RESOLUTION - 9) << 5 | 0x1F
+            _1WIRE.reset()
+            _1WIRE.write(SKIP_ROM_WRITE_SCRATCH + bytes([0, 0, cfg]))
+        if sm:
+            sm.roms = [r or bytes(8) for r in slots]
+    while slots and slots[-1] is None:
+        slots.pop()
+    return [OneWireAddress(r) if r else None for r in slots]
+
+def temp_start(sm=None, rescan=False):
+    # Phase 1 of a split-phase temperature measurement: start a conversion on
+    # all the DS18B20 probes at once with a Skip ROM Convert T, so the wait
+    # is one conversion time no matter how many probes there are. Returns a
+    # pending tuple for temp_finish() whose last item is the time.monotonic()
+    # time when the conversion will be done, or None if there's no sensor.
+    addresses = find_ds18b20s(sm, rescan)
+    if not any(addresses):
+        return None
+    _1WIRE.reset()
+    _1WIRE.write(SKIP_ROM_CONVERT_T)
+    return (addresses, monotonic() + CONVERSION_S)
+
+def temp_finish(pending, sm=None, retry=True):
+    # Phase 2 of a split-phase temperature measurement: return a list of
+    # temperatures in Fahrenheit (int8), one per probe. If reading a cached
+    # probe fails (CRC error or no presence pulse from a replaced or
+    # disconnected sensor), this rescans the bus and tries once more.
+    if not pending:
+        return [NO_DATA]
+    (addresses, _) = pending
+    # Until all the conversions are done, the probes answer read slots with
+    # 0. This only spins if a probe lost its resolution setting.
+    buf = bytearray(1)
+    t0 = monotonic()
+    _1WIRE.readinto(buf)
+    while (buf[0] == 0) and (monotonic() - t0 < 1):
+        _1WIRE.readinto(buf)
+    temps = []
+    failed = False
+    for a in addresses:
+        F = NO_DATA
+        if a:
+            try:
+                # Convert °C to °F
+                F = round((DS18X20(_1WIRE, a).read_temperature() * 1.8) + 32)
+            except RuntimeError:
+                failed = True
+        temps.append(F)
+    if not (failed and retry):
+        return temps
+    print("WARNING: CACHED DS18B20 FAILED, RESCANNING")
+    pending = temp_start(sm, rescan=True)
+    if pending:
+        sleep(max(0, pending[-1] - monotonic()))
+    return temp_finish(pending, sm, retry=False)
+
+def temps_f(sm=None):
+    # Return a list of temperature measurements in Fahrenheit (int8), one
+    # per DS18B20 probe, waiting for the conversion with sleep(). See
+    # find_ds18b20s() for what sm does.
+    pending = temp_start(sm)
+    if pending:
+        sleep(max(0, pending[-1] - monotonic()))
+    return temp_finish(pending, sm)
+
+def temp_f(sm=None):
+    # Return a temperature measurement in Fahrenheit (int8) from the first
+    # DS18B20 probe
+    return temps_f(sm)[0]
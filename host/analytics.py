@@ -0,0 +1,222 @@
+# SPDX-License-Identifier: MIT
+"""
+Compare how greenhouse structures respond to the weather, using logs from a
+host/archive.py archive.
+
+All the loggers' first probe temperatures get corrected for RTC drift and
+resampled onto one common time grid (a loggers x samples array), so each
+statistic is a few NumPy operations over the whole fleet at once:
+
+- degree-hours above and below thresholds (°F above or below, times hours)
+- daily minimum, mean, and maximum
+- thermal lag: the delay that best lines up each logger's temperature swings
+  with a reference logger (outside air, or a structure to compare against),
+  with the correlation at that lag
+
+Usage:
+
+    python3 host/analytics.py ARCHIVE [--start T] [--end T]
+        [--logger NAME ...] [--step MINUTES] [--above F] [--below F]
+        [--reference NAME] [--max-lag HOURS] [--daily daily.csv]
+
+Drift correction: util.set_clock() sets the RTC right when a log starts, and
+the archive keeps the drift that host/fleet.py measured at each collection.
+The error in between is taken to grow linearly, so board times get corrected
+by interpolating between those readings.
+
+Resampling holds each logged value until the next record, like util.dump(),
+but leaves grid points more than --max-gap hours after a record empty (NaN),
+since the logger wasn't sampling then.
+
+Needs NumPy.
+"""
+import argparse
+import csv
+import os.path
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from archive import Archive, format_time, parse_time
+
+
+# Longest time to hold a record: MAX_GAP_S in code.py plus half a sample
+# interval
+MAX_GAP_S = 3 * 3600 + 600
+
+
+def correct_drift(t, clock, t0):
+    # Map board timestamps t to true time. clock is the series' list of
+    # [board time, seconds fast] readings, and t0 is the first timestamp of
+    # the whole series, which counts as a reading with no error
+    # (util.set_clock() just set the RTC). t may be any slice of the series.
+    if not clock or len(t) == 0:
+        return t
+    xs = [t0] + [c[0] for c in clock if c[0] > t0]
+    ys = [0.0] + [c[1] for c in clock if c[0] > t0]
+    if len(xs) < 2:
+        return t
+    # np.interp holds the end values flat, so extend the last slope instead
+    fast = np.interp(t, xs, ys)
+    late = t > xs[-1]
+    if late.any():
+        slope = (ys[-1] - ys[-2]) / (xs[-1] - xs[-2])
+        fast[late] = ys[-1] + slope * (t[late] - xs[-1])
+    return t - np.round(fast).astype(t.dtype)
+
+def load(archive, start=None, end=None, loggers=None):
+    # Return {logger: (times, tempF)} with drift corrected times, joining the
+    # deployments of each logger in time order
+    parts = {}
+    for (s, cols) in archive.query(start, end, loggers):
+        t = correct_drift(np.asarray(cols['time']), s.get('clock'),
+                          s['segments'][0][2])
+        parts.setdefault(s['logger'], []).append(
+            (t, np.asarray(cols['tempF'], dtype=np.float32)))
+    series = {}
+    for (name, chunks) in parts.items():
+        chunks.sort(key=lambda c: c[0][0])
+        series[name] = (np.concatenate([c[0] for c in chunks]),
+                        np.concatenate([c[1] for c in chunks]))
+    return series
+
+def resample(series, grid, max_gap=MAX_GAP_S):
+    # Sample and hold each (times, values) series onto the grid timestamps.
+    # Returns a float32 array of shape (len(series), len(grid)), with NaN
+    # where a logger has no record within max_gap before the grid point.
+    out = np.full((len(series), len(grid)), np.nan, dtype=np.float32)
+    for (row, (t, v)) in enumerate(series):
+        i = np.searchsorted(t, grid, 'right') - 1
+        ok = i >= 0
+        ok[ok] = (grid[ok] - t[i[ok]]) <= max_gap
+        out[row, ok] = v[i[ok]]
+    return out
+
+def degree_hours(temps, step, threshold, above=True):
+    # Sum of °F beyond the threshold times hours, per logger. Empty grid
+    # points count as zero.
+    diff = temps - threshold if above else threshold - temps
+    return np.nansum(np.clip(diff, 0, None), axis=1) * (step / 3600)
+
+def daily_extremes(grid, temps):
+    # Return (day start timestamps, min, mean, max), each stat an array of
+    # shape (loggers, days). The grid must start at midnight with a step
+    # that divides a day.
+    per_day = int(86400 // (grid[1] - grid[0]))
+    days = len(grid) // per_day
+    cube = temps[:, :days * per_day].reshape(len(temps), days, per_day)
+    with warnings.catch_warnings():
+        # Days with no data at all come out NaN, which is what we want
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = (np.nanmin(cube, axis=2), np.nanmean(cube, axis=2),
+                 np.nanmax(cube, axis=2))
+    return (grid[:days * per_day:per_day],) + stats
+
+def lag_correlation(temps, ref, max_lag):
+    # Cross-correlate every logger's temperature with row ref, for lags of
+    # -max_lag..max_lag grid steps (positive means the logger lags behind
+    # the reference). Gaps get filled by linear interpolation and each row's
+    # mean removed first. Returns (best lag in steps, correlation at it),
+    # arrays with one entry per logger, using one batched FFT.
+    n = temps.shape[1]
+    x = np.empty(temps.shape, dtype=np.float64)
+    idx = np.arange(n)
+    for (row, v) in enumerate(temps):
+        ok = ~np.isnan(v)
+        x[row] = np.interp(idx, idx[ok], v[ok]) if ok.any() else 0.0
+    x -= x.mean(axis=1, keepdims=True)
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spec = np.fft.rfft(x, size, axis=1)
+    cc = np.fft.irfft(spec * np.conj(spec[ref]), size, axis=1)
+    # cc[:, k] is sum(x[t + k] * ref[t]), with negative k wrapped around
+    lags = np.arange(-max_lag, max_lag + 1)
+    cc = cc[:, lags % size]
+    norm = np.sqrt((x * x).sum(axis=1) * (x[ref] * x[ref]).sum())
+    with np.errstate(all='ignore'):
+        r = cc / norm[:, None]
+    r = np.nan_to_num(r)
+    best = np.argmax(r, axis=1)
+    return (lags[best], r[np.arange(len(r)), best])
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('archive', help='archive directory from host/archive.py')
+    ap.add_argument('--start', help='first day (default: all)')
+    ap.add_argument('--end', help='last time (default: all)')
+    ap.add_argument('--logger', action='append',
+                    help='only this logger (repeat for more)')
+    ap.add_argument('--step', type=int, default=20,
+                    help='grid step in minutes (default: 20)')
+    ap.add_argument('--above', type=float, default=86.0,
+                    help='heat threshold °F for degree-hours (default: 86)')
+    ap.add_argument('--below', type=float, default=32.0,
+                    help='cold threshold °F for degree-hours (default: 32)')
+    ap.add_argument('--reference', help='logger to measure thermal lag '
+                    'against (default: the first one)')
+    ap.add_argument('--max-lag', type=float, default=6.0,
+                    help='longest thermal lag to look for, hours '
+                    '(default: 6)')
+    ap.add_argument('--max-gap', type=float, default=MAX_GAP_S / 3600,
+                    help='hours to hold a record before leaving a gap '
+                    '(default: %.2f)' % (MAX_GAP_S / 3600))
+    ap.add_argument('--daily', metavar='CSV',
+                    help='also write daily min/mean/max per logger to CSV')
+    args = ap.parse_args()
+    if (1440 % args.step) != 0:
+        sys.exit('ERROR: --step must divide a day (1440 minutes)')
+    t0 = time.perf_counter()
+    start = parse_time(args.start) if args.start else None
+    end = parse_time(args.end) if args.end else None
+    series = load(Archive(args.archive), start, end, args.logger)
+    if not series:
+        sys.exit('ERROR: no data in range')
+    names = sorted(series)
+    step = args.step * 60
+    first = min(series[n][0][0] for n in names)
+    last = max(series[n][0][-1] for n in names)
+    g0 = (max(first, start or first) // 86400) * 86400
+    g1 = min(last, end or last)
+    grid = np.arange(g0, g1 + 1, step, dtype=np.int64)
+    temps = resample([series[n] for n in names], grid,
+                     int(args.max_gap * 3600))
+    ref = names.index(args.reference) if args.reference else 0
+    heat = degree_hours(temps, step, args.above, above=True)
+    cold = degree_hours(temps, step, args.below, above=False)
+    (days, lo, mean, hi) = daily_extremes(grid, temps)
+    (lag, r) = lag_correlation(temps, ref, int(args.max_lag * 3600 // step))
+    elapsed = time.perf_counter() - t0
+    print('%d loggers, %s to %s, %d grid points of %d min' % (
+        len(names), format_time(grid[0]), format_time(grid[-1]),
+        len(grid), args.step))
+    print('%-48s %7s %8s %8s %7s %7s %6s %6s' % (
+        'logger', 'mean °F', '>%g °Fh' % args.above,
+        '<%g °Fh' % args.below, 'day lo', 'day hi', 'lag h', 'r'))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        overall = np.nanmean(temps, axis=1)
+        day_lo = np.nanmean(lo, axis=1)
+        day_hi = np.nanmean(hi, axis=1)
+    for (i, name) in enumerate(names):
+        print('%-48s %7.1f %8.0f %8.0f %7.1f %7.1f %6.2f %6.2f%s' % (
+            name, overall[i], heat[i], cold[i], day_lo[i], day_hi[i],
+            lag[i] * step / 3600, r[i], ' (reference)' if i == ref else ''))
+    print('(day lo/hi are means of the daily extremes; lag is how far each '
+          'logger trails %s)' % names[ref])
+    print('computed in %.3f s' % elapsed)
+    if args.daily:
+        with open(args.daily, 'w', newline='') as f:
+            out = csv.writer(f)
+            out.writerow(['logger', 'date', 'min °F', 'mean °F', 'max °F'])
+            for (i, name) in enumerate(names):
+                for (d, day) in enumerate(days):
+                    if not np.isnan(mean[i, d]):
+                        out.writerow([name, format_time(day)[:10],
+                                      '%.0f' % lo[i, d], '%.1f' % mean[i, d],
+                                      '%.0f' % hi[i, d]])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# SPDX-License-Identifier: MIT
+"""
+Append-only columnar archive of downloaded logs, for fast range queries.
+
+Every collection adds more util.dump() CSV files (`M/D HH:MM,°F,centi-Volts`,
+no year) per logger. This ingests them into an archive directory with one
+series per logger and deployment (a log started by util.set_clock()), stored
+as fixed-width binary columns:
+
+    <archive>/index.json                      series and segment index
+    <archive>/<logger>/<deployment>/time.bin  int64 timestamps (board time)
+    <archive>/<logger>/<deployment>/tempF.bin int8 °F (tempF_2.bin, etc for
+                                              extra probes)
+    <archive>/<logger>/<deployment>/cV.bin    int16 centi-Volts
+
+Each ingest appends one segment, and the index records its row range and
+time range. A query only opens the columns of series with segments in the time
+range, as NumPy memmaps, and binary searches the time column. Reading years
+of data from many loggers only touches the pages in the range.
+
+Usage:
+
+    python3 host/archive.py ingest ARCHIVE CSV ... [--logger NAME]
+                            [--deployment NAME] [--collected TIME]
+                            [--drift S]
+    python3 host/archive.py info ARCHIVE
+    python3 host/archive.py query ARCHIVE [--start T] [--end T]
+                            [--logger NAME ...] > rows.csv
+
+The logger name defaults to the file name (host/fleet.py names files
+<board_id>-<uid>.csv). The deployment defaults to the date of the first row.
+Dumps of the same log overlap, so ingest only appends rows newer than the
+series already holds. The year of each row comes from the collection date:
+--collected, else the util.now() reading in a fleet.csv next to the file,
+else the file's modification time. Times for --collected, --start, and --end
+look like 2025-03-01 or '2025-03-01 22:00'.
+
+The RTC drift measured at collection (by host/fleet.py, or --drift for the
+seconds the board's clock was fast at --collected) gets saved with the series,
+so host/analytics.py can correct for it.
+
+Needs NumPy.
+"""
+import argparse
+import calendar
+import csv
+import json
+import os
+import os.path
+import re
+import sys
+import time
+
+import numpy as np
+
+
+# Rows of util.dump() output: month/day hour:minute, °F, cV, more °F columns
+ROW_RE = re.compile(r'^(\d+)/(\d+) (\d+):(\d+),(-?\d+),(-?\d+)((?:,-?\d+)*)$')
+
+TIME_DTYPE = np.dtype('<i8')
+TEMP_DTYPE = np.dtype('i1')
+CV_DTYPE = np.dtype('<i2')
+
+
+def column_dtypes(probes):
+    # Return [(column name, dtype)] for a series with this many probes
+    cols = [('time', TIME_DTYPE), ('tempF', TEMP_DTYPE), ('cV', CV_DTYPE)]
+    cols += [('tempF_%d' % p, TEMP_DTYPE) for p in range(2, probes + 1)]
+    return cols
+
+def parse_time(s):
+    # Parse 'YYYY-MM-DD[ HH:MM]' as a timestamp on the board's clock
+    # (local time, no timezone)
+    for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return calendar.timegm(time.strptime(s, fmt))
+        except ValueError:
+            pass
+    raise ValueError('bad time %r (use YYYY-MM-DD or "YYYY-MM-DD HH:MM")' % s)
+
+def format_time(t):
+    return time.strftime('%Y-%m-%d %H:%M', time.gmtime(t))
+
+def read_dump(path):
+    # Return (probes, [(month, day, hour, minute, tempF, cV, °F 2, ...)])
+    # from a util.dump() capture. Lines that aren't rows (comments, the
+    # header, REPL noise) get skipped.
+    (probes, rows) = (None, [])
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            m = ROW_RE.match(line.strip())
+            if not m:
+                continue
+            extra = [int(v) for v in m[7].split(',')[1:]]
+            if probes is None:
+                probes = 1 + len(extra)
+            elif probes != 1 + len(extra):
+                raise ValueError('%s: rows have different column counts'
+                                 % path)
+            rows.append(tuple(int(v) for v in m.groups()[:6]) + tuple(extra))
+    return (probes or 1, rows)
+
+def fleet_reading(path):
+    # Return (board time, RTC drift seconds) of the util.now() reading that
+    # host/fleet.py took when it downloaded this file, or None
+    summary = os.path.join(os.path.dirname(path), 'fleet.csv')
+    board = os.path.splitext(os.path.basename(path))[0]
+    if not os.path.exists(summary):
+        return None
+    with open(summary, newline='') as f:
+        for r in csv.DictReader(f):
+            if r.get('board') != board or not r.get('rtc'):
+                continue
+            t = calendar.timegm(time.strptime(r['rtc'][:19],
+                                              '%Y-%m-%d %H:%M:%S'))
+            drift = r.get('rtc_drift_s')
+            return (t, float(drift) if drift else None)
+    return None
+
+def timestamps(rows, collected):
+    # Work out the year of each row, going backward from the collection time:
+    # the last row can't be later than that, and the year changes wherever
+    # the month and day go backward. Returns an int64 array of timestamps.
+    collected = time.gmtime(collected)
+    year = collected[0]
+    if tuple(rows[-1][:2]) > tuple(collected[1:3]):
+        year -= 1
+    years = [0] * len(rows)
+    next_md = rows[-1][:2]
+    for i in range(len(rows) - 1, -1, -1):
+        md = rows[i][:2]
+        if md > next_md:
+            year -= 1
+        years[i] = year
+        next_md = md
+    # Only convert a full date once per day
+    (out, day, day_t) = ([], None, 0)
+    for (y, r) in zip(years, rows):
+        if (y, r[0], r[1]) != day:
+            day = (y, r[0], r[1])
+            day_t = calendar.timegm((y, r[0], r[1], 0, 0, 0))
+        out.append(day_t + r[2] * 3600 + r[3] * 60)
+    return np.array(out, dtype=TIME_DTYPE)
+
+
+class Archive:
+    # A directory of column files plus index.json. The index only gets
+    # rewritten (atomically) after the column data it describes is on disk,
+    # and appends first cut the columns back to the indexed length, so a
+    # crash mid-ingest loses at most that ingest.
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, 'index.json')
+        self.index = {'version': 1, 'series': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+
+    def save_index(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.index_path)
+
+    def series_dir(self, s):
+        return os.path.join(self.root, s['logger'], s['deployment'])
+
+    def columns(self, s):
+        # Return {name: read-only memmap} for all rows of series s
+        cols = {}
+        for (name, dtype) in column_dtypes(s['probes']):
+            path = os.path.join(self.series_dir(s), name + '.bin')
+            cols[name] = np.memmap(path, dtype=dtype, mode='r',
+                                   shape=(s['rows'],))
+        return cols
+
+    def ingest(self, path, logger=None, deployment=None, collected=None,
+               drift=None):
+        # Append the new rows of a util.dump() capture. collected is the
+        # board time when it was downloaded, and drift how many seconds fast
+        # the board's RTC was then (None if not measured). Returns (series
+        # key, rows added).
+        (probes, rows) = read_dump(path)
+        if not rows:
+            return (None, 0)
+        if collected is None:
+            reading = fleet_reading(path)
+            if reading:
+                (collected, drift) = reading
+            else:
+                collected = calendar.timegm(
+                    time.localtime(os.path.getmtime(path)))
+        t = timestamps(rows, collected)
+        logger = logger or os.path.splitext(os.path.basename(path))[0]
+        deployment = deployment or format_time(t[0])[:10]
+        key = '%s/%s' % (logger, deployment)
+        s = self.index['series'].setdefault(key, {
+            'logger': logger, 'deployment': deployment, 'probes': probes,
+            'rows': 0, 'segments': [],
+        })
+        if s['probes'] != probes:
+            raise ValueError('%s: %d probes, but series %s has %d' % (
+                path, probes, key, s['probes']))
+        clock = s.setdefault('clock', [])
+        if drift is not None and collected not in [c[0] for c in clock]:
+            # RTC readings as [board time, seconds fast], oldest first
+            clock.append([collected, drift])
+            clock.sort()
+        if s['segments']:
+            # Skip the rows already archived by an earlier dump of this log
+            start = int(np.searchsorted(t, s['segments'][-1][3], 'right'))
+            (t, rows) = (t[start:], rows[start:])
+        if not rows:
+            self.save_index()
+            return (key, 0)
+        data = np.array([r[4:] for r in rows], dtype=np.int64)
+        values = {'time': t, 'tempF': data[:, 0], 'cV': data[:, 1]}
+        for p in range(2, probes + 1):
+            values['tempF_%d' % p] = data[:, p]
+        os.makedirs(self.series_dir(s), exist_ok=True)
+        for (name, dtype) in column_dtypes(probes):
+            col = os.path.join(self.series_dir(s), name + '.bin')
+            with open(col, 'ab') as f:
+                f.truncate(s['rows'] * dtype.itemsize)
+                f.write(values[name].astype(dtype).tobytes())
+        s['segments'].append([s['rows'], len(t), int(t[0]), int(t[-1]),
+                              os.path.basename(path)])
+        s['rows'] += len(t)
+        self.save_index()
+        return (key, len(t))
+
+    def query(self, start=None, end=None, loggers=None):
+        # Generate (series, {column: array}) for the rows of each series in
+        # the time range, where series is the index entry. The arrays are
+        # slices of memmaps, so only the pages in range get read.
+        for key in sorted(self.index['series']):
+            s = self.index['series'][key]
+            if loggers and s['logger'] not in loggers:
+                continue
+            segs = [
+                seg for seg in s['segments']
+                if (start is None or seg[3] >= start)
+                and (end is None or seg[2] <= end)
+            ]
+            if not segs:
+                continue
+            (lo, hi) = (segs[0][0], segs[-1][0] + segs[-1][1])
+            cols = self.columns(s)
+            t = cols['time'][lo:hi]
+            i = lo if start is None else lo + int(
+                np.searchsorted(t, start, 'left'))
+            j = hi if end is None else lo + int(
+                np.searchsorted(t, end, 'right'))
+            if i < j:
+                yield (s, {name: col[i:j] for (name, col) in cols.items()})
+
+
+def cmd_ingest(args):
+    archive = Archive(args.archive)
+    collected = parse_time(args.collected) if args.collected else None
+    if args.drift is not None and collected is None:
+        sys.exit('ERROR: --drift needs --collected')
+    for path in args.csv:
+        if os.path.basename(path) == 'fleet.csv':
+            continue
+        (key, n) = archive.ingest(path, args.logger, args.deployment,
+                                  collected, args.drift)
+        print('%s: %d new rows -> %s' % (path, n, key))
+
+def cmd_info(args):
+    archive = Archive(args.archive)
+    print('%-48s %-10s %6s %8s  %-16s  %-16s' % (
+        'logger', 'deployed', 'probes', 'rows', 'first', 'last'))
+    for key in sorted(archive.index['series']):
+        s = archive.index['series'][key]
+        segs = s['segments']
+        print('%-48s %-10s %6d %8d  %-16s  %-16s' % (
+            s['logger'], s['deployment'], s['probes'], s['rows'],
+            format_time(segs[0][2]), format_time(segs[-1][3])))
+
+def cmd_query(args):
+    archive = Archive(args.archive)
+    start = parse_time(args.start) if args.start else None
+    end = parse_time(args.end) if args.end else None
+    found = list(archive.query(start, end, args.logger))
+    probes = max([s['probes'] for (s, _) in found] or [1])
+    out = csv.writer(sys.stdout, lineterminator='\n')
+    out.writerow(['logger', 'deployment', 'Date Time', '°F', 'centi-Volts']
+                 + ['°F %d' % p for p in range(2, probes + 1)])
+    for (s, cols) in found:
+        extra = [cols['tempF_%d' % p] for p in range(2, s['probes'] + 1)]
+        pad = [''] * (probes - s['probes'])
+        for i in range(len(cols['time'])):
+            out.writerow(
+                [s['logger'], s['deployment'], format_time(cols['time'][i]),
+                 cols['tempF'][i], cols['cV'][i]]
+                + [c[i] for c in extra] + pad)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('ingest', help='add util.dump() CSV files')
+    p.add_argument('archive', help='archive directory')
+    p.add_argument('csv', nargs='+', help='CSV file(s) from util.dump() or '
+                   'host/fleet.py')
+    p.add_argument('--logger', help='logger name (default: file name)')
+    p.add_argument('--deployment',
+                   help='deployment name (default: date of first row)')
+    p.add_argument('--collected', metavar='TIME',
+                   help='board time when the log was downloaded, for the '
+                   'year of rows')
+    p.add_argument('--drift', type=float, metavar='S',
+                   help='seconds the board RTC was fast at --collected')
+    p.set_defaults(func=cmd_ingest)
+    p = sub.add_parser('info', help='list the archived series')
+    p.add_argument('archive', help='archive directory')
+    p.set_defaults(func=cmd_info)
+    p = sub.add_parser('query', help='print rows in a time range as CSV')
+    p.add_argument('archive', help='archive directory')
+    p.add_argument('--start', help='first time (default: all)')
+    p.add_argument('--end', help='last time (default: all)')
+    p.add_argument('--logger', action='append',
+                   help='only this logger (repeat for more)')
+    p.set_defaults(func=cmd_query)
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: MIT
+"""
+Wake-cycle benchmark for the logger firmware, run on the host.
+
+This simulates a deployment: thousands of deep sleep wake cycles of the
+unmodified code.py against the simulated board in host/cpy/, then a
+util.dump() of the resulting log. It reports per-wake awake time (modeled
+hardware waits plus host CPU time), sleep memory traffic, estimated battery
+life, and dump throughput.
+
+Host CPU time is much smaller than the same code takes on an ESP32-S3, so
+compare it between runs rather than reading it as a device number. Modeled
+wait time (sleep() calls, 1-wire bus and conversion time, etc) is directly
+comparable to the hardware.
+
+Usage: python3 host/bench.py [--wakes N] [--board BOARD_ID] [--probes N]
+"""
+import argparse
+import os.path
+import sys
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import emulator
+
+
+def percentile(sorted_vals, p):
+    i = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[i]
+
+def ms_row(label, vals):
+    v = sorted(vals)
+    mean = sum(v) / len(v)
+    return '%-22s %9.2f %9.2f %9.2f %9.2f' % (
+        label, mean * 1e3, percentile(v, 50) * 1e3, percentile(v, 95) * 1e3,
+        v[-1] * 1e3)
+
+def bench_wakes(n):
+    stats = [emulator.wake() for _ in range(n)]
+    w = emulator.world()
+    print('== %d wake cycles (%s) ==' % (n, w.board_id))
+    print('%-22s %9s %9s %9s %9s' % ('per wake (ms)', 'mean', 'p50', 'p95',
+                                     'max'))
+    print(ms_row('awake', [s.awake_s for s in stats]))
+    print(ms_row('  modeled waits', [s.modeled_s for s in stats]))
+    print(ms_row('  host CPU', [s.cpu_s for s in stats]))
+    print('%-22s %9.1f' % ('sleep_memory writes (B)',
+                           sum(s.bytes_written for s in stats) / n))
+    print('%-22s %9.1f' % ('sleep_memory reads (B)',
+                           sum(s.bytes_read for s in stats) / n))
+    print('%-22s %9.1f' % ('console output (B)',
+                           sum(s.printed for s in stats) / n))
+    spill = os.path.join(w.circuitpy.name, 'log.bin')
+    spilled = os.path.getsize(spill) if os.path.exists(spill) else 0
+    print('%-22s %9d' % ('flash spill file (B)', spilled))
+    days = sum(s.awake_s + s.asleep_s for s in stats) / 86400
+    mah_per_day = w.battery.used_mah / days
+    print('%-22s %9.2f' % ('simulated days', days))
+    print('%-22s %9.3f' % ('battery mAh/day', mah_per_day))
+    print('%-22s %9.1f' % ('est. days on %d mAh' % w.battery.capacity_mah,
+                           w.battery.capacity_mah / mah_per_day))
+
+def bench_dump(repeat):
+    sink = emulator.CountingWriter()
+    with emulator.repl(stdout=sink):
+        util = emulator.load('util')
+        t0 = perf_counter()
+        for _ in range(repeat):
+            util.dump()
+        dt = (perf_counter() - t0) / repeat
+    records = max(0, sink.lines // repeat - 2)   # two header lines
+    print('== util.dump() x%d ==' % repeat)
+    print('%-22s %9d' % ('records', records))
+    print('%-22s %9d' % ('output bytes', sink.chars // repeat))
+    print('%-22s %9.2f' % ('host ms per dump', dt * 1e3))
+    print('%-22s %9.0f' % ('records/s', records / dt if dt else 0))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('--wakes', type=int, default=2000,
+                    help='number of wake cycles to simulate (default 2000)')
+    ap.add_argument('--board', default='adafruit_feather_esp32s3_nopsram',
+                    help='simulated board_id')
+    ap.add_argument('--probes', type=int, default=1,
+                    help='number of DS18B20 probes on the 1-wire bus')
+    ap.add_argument('--dump-repeat', type=int, default=5,
+                    help='number of util.dump() runs to average')
+    args = ap.parse_args()
+    emulator.reset_world(board_id=args.board, probes=args.probes)
+    bench_wakes(args.wakes)
+    print()
+    bench_dump(args.dump_repeat)
+
+
+if __name__ == '__main__':
+    main()
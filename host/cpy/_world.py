@@ -0,0 +1,220 @@
+# SPDX-License-Identifier: MIT
+#
+# Shared simulated hardware state for the host-side CircuitPython stand-ins in
+# this directory. Everything that survives an ESP32 deep sleep (sleep memory,
+# RTC, battery charge, attached sensors) lives here, so the fake `alarm`,
+# `board`, `rtc`, etc. modules can all see the same world.
+import calendar
+import math
+import tempfile
+from time import perf_counter
+
+
+class DeepSleep(Exception):
+    # Raised by alarm.exit_and_deep_sleep_until_alarms() to end a wake cycle
+    def __init__(self, alarms):
+        super().__init__('deep sleep')
+        self.alarms = alarms
+
+
+class SleepMemory:
+    # Stand-in for alarm.sleep_memory that counts bytes read and written
+
+    def __init__(self, size=4096):
+        self.buf = bytearray(size)
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __len__(self):
+        return len(self.buf)
+
+    def __getitem__(self, key):
+        val = self.buf[key]
+        self.bytes_read += len(val) if isinstance(key, slice) else 1
+        return val
+
+    def __setitem__(self, key, val):
+        if isinstance(key, slice):
+            # Like CircuitPython, slice assignments may not resize the buffer
+            n = len(range(*key.indices(len(self.buf))))
+            if len(val) != n:
+                raise ValueError('Slice and value different lengths')
+            self.bytes_written += n
+        else:
+            self.bytes_written += 1
+        self.buf[key] = val
+
+
+class Clock:
+    # Virtual clock: modeled waits plus real CPU time spent running device
+    # code. time.sleep(), sensor conversions, and deep sleep advance the
+    # modeled part instantly, so simulating a week of wakes takes seconds.
+    # Host CPU time only counts between run() and stop().
+
+    def __init__(self, rtc_epoch):
+        self.modeled = 0.0
+        self.cpu = 0.0
+        self.t_run = None
+        self.rtc_offset = rtc_epoch
+
+    def run(self):
+        self.t_run = perf_counter()
+
+    def stop(self):
+        self.cpu += perf_counter() - self.t_run
+        self.t_run = None
+
+    def monotonic(self):
+        t = self.modeled + self.cpu
+        if self.t_run is not None:
+            t += perf_counter() - self.t_run
+        return t
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self.modeled += seconds
+
+    def advance_to(self, monotonic_time):
+        self.advance(monotonic_time - self.monotonic())
+
+    def time(self):
+        # RTC time in whole seconds, like CircuitPython time.time()
+        return int(self.rtc_offset + self.monotonic())
+
+    def set_time(self, seconds):
+        self.rtc_offset = seconds - self.monotonic()
+
+
+def hardware(fn):
+    # Decorator for stand-in driver internals: time spent simulating the
+    # hardware itself shouldn't count as device CPU time
+    def wrapper(*args, **kwargs):
+        clock = world.clock
+        running = clock.t_run is not None
+        if running:
+            clock.stop()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if running:
+                clock.run()
+    return wrapper
+
+
+class Battery:
+    # Crude LiPo model: linear voltage over the usable charge. Current draws
+    # are typical ESP32-S3 CircuitPython numbers, good enough for comparing
+    # wake path changes against each other.
+
+    ACTIVE_MA = 45.0
+    LIGHT_SLEEP_MA = 1.5
+    DEEP_SLEEP_MA = 0.1
+
+    def __init__(self, capacity_mah=400.0, full_v=4.18, empty_v=3.30):
+        self.capacity_mah = capacity_mah
+        self.full_v = full_v
+        self.empty_v = empty_v
+        self.used_mah = 0.0
+
+    def drain(self, seconds, ma):
+        self.used_mah += seconds * ma / 3600.0
+
+    @property
+    def volts(self):
+        frac = max(0.0, 1.0 - self.used_mah / self.capacity_mah)
+        return self.empty_v + (self.full_v - self.empty_v) * frac
+
+
+class World:
+    # All of the simulated hardware for one logger board
+
+    def __init__(self, board_id='adafruit_feather_esp32s3_nopsram',
+                 rtc_epoch=calendar.timegm((2025, 1, 1, 0, 0, 0)),
+                 probes=1, uid=bytes.fromhex('f412fa4b0001')):
+        self.board_id = board_id
+        self.uid = uid
+        self.clock = Clock(rtc_epoch)
+        self.sleep_memory = SleepMemory()
+        # microcontroller.nvm, which keeps per-board settings through resets,
+        # code updates, and a flat battery
+        self.nvm = bytearray(8192)
+        self.battery = Battery()
+        self.a0_grounded = False
+        self.neopixel_writes = 0
+        self.onewire = [
+            DS18B20(rom_for(i), offset_c=2.0 * i) for i in range(probes)
+        ]
+        # The CIRCUITPY drive. Device code runs with this as its working
+        # directory, so relative paths like 'log.bin' land here.
+        self.circuitpy = tempfile.TemporaryDirectory(prefix='circuitpy-')
+
+    def temperature_c(self):
+        # Diurnal swing around 12 °C, peaking mid afternoon
+        t = self.clock.time()
+        day_frac = (t % 86400) / 86400.0
+        return 12.0 + 10.0 * math.sin(2 * math.pi * (day_frac - 0.375))
+
+    def sleep(self, seconds, ma=Battery.ACTIVE_MA):
+        # Model a blocking wait without burning host time
+        self.clock.advance(seconds)
+        self.battery.drain(seconds, ma)
+
+
+def crc8(data):
+    # Dallas/Maxim 1-wire CRC8 (polynomial x^8 + x^5 + x^4 + 1)
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            mix = (crc ^ byte) & 1
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+
+def rom_for(i):
+    # Make a valid 64-bit DS18B20 ROM code (family 0x28) for probe number i
+    rom = bytes([0x28, 0xAA, 0x10 + i, 0x55, 0x00, 0x01, 0x42])
+    return rom + bytes([crc8(rom)])
+
+
+class DS18B20:
+    # Simulated 1-wire DS18B20 with scratchpad, resolution, and conversion
+    # timing. Conversion time depends on resolution per the datasheet.
+
+    CONVERSION_S = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.750}
+
+    def __init__(self, rom, offset_c=0.0):
+        self.rom = rom
+        self.offset_c = offset_c
+        self.present = True
+        self.config = 0x7F          # 12-bit
+        self.th = 0x4B
+        self.tl = 0x46
+        self.raw = 0x0550           # 85 °C power-on reset value
+        self.done_at = None
+
+    @property
+    def resolution(self):
+        return 9 + ((self.config >> 5) & 3)
+
+    def start_conversion(self, now, temp_c):
+        self.done_at = now + self.CONVERSION_S[self.resolution]
+        mask = 0xFFFF << (12 - self.resolution)
+        self.raw = int(round((temp_c + self.offset_c) * 16)) & mask & 0xFFFF
+
+    def busy(self, now):
+        return self.done_at is not None and now < self.done_at
+
+    def scratchpad(self):
+        sp = bytes([
+            self.raw & 0xFF, self.raw >> 8, self.th, self.tl, self.config,
+            0xFF, 0x0C, 0x10,
+        ])
+        return sp + bytes([crc8(sp)])
+
+
+# The one simulated board that the stand-in modules talk to. Replace it with
+# emulator.reset_world() to start a fresh deployment.
+world = World()
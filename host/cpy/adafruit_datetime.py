@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for adafruit_datetime. CircuitPython has no timezones, so
+# fromtimestamp() gives naive RTC (UTC) time rather than host local time.
+import datetime as _dt
+
+from datetime import date, time, timedelta
+
+
+class datetime(_dt.datetime):
+
+    @classmethod
+    def fromtimestamp(cls, timestamp, tz=None):
+        t = _dt.datetime.fromtimestamp(timestamp, _dt.timezone.utc)
+        return cls(*t.timetuple()[:6])
@@ -0,0 +1,94 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for adafruit_ds18x20, following the real driver's use of the
+# 1-wire bus closely enough that bus and conversion time are modeled.
+import time
+
+from adafruit_onewire.device import OneWireDevice
+
+
+_CONVERT = b'\x44'
+_RD_SCRATCH = b'\xBE'
+_WR_SCRATCH = b'\x4E'
+_CONVERSION_TIMEOUT = 1
+RESOLUTION = (9, 10, 11, 12)
+# Maximum conversion delay in seconds, from DS18B20 datasheet
+_CONVERSION_DELAY = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.750}
+
+
+class DS18X20:
+
+    def __init__(self, bus, address):
+        if address.family_code in (0x10, 0x28):
+            self._address = address
+            self._device = OneWireDevice(bus, address)
+            self._buf = bytearray(9)
+            self._conv_delay = _CONVERSION_DELAY[12]
+        else:
+            raise ValueError('Incorrect family code in device address.')
+
+    @property
+    def temperature(self):
+        self._convert_temp()
+        return self._read_temp()
+
+    @property
+    def resolution(self):
+        return self._read_resolution()
+
+    @resolution.setter
+    def resolution(self, bits):
+        if bits not in RESOLUTION:
+            raise ValueError('Incorrect resolution. Must be 9, 10, 11, or 12.')
+        self._buf[0] = 0  # TH register
+        self._buf[1] = 0  # TL register
+        self._buf[2] = RESOLUTION.index(bits) << 5 | 0x1F  # configuration
+        with self._device as dev:
+            dev.write(_WR_SCRATCH)
+            dev.write(self._buf, end=3)
+        self._conv_delay = _CONVERSION_DELAY[bits]
+
+    def _read_resolution(self):
+        self._read_scratch()
+        return RESOLUTION[self._buf[4] >> 5 & 0x03]
+
+    def _convert_temp(self, timeout=_CONVERSION_TIMEOUT):
+        with self._device as dev:
+            dev.write(_CONVERT)
+            start_time = time.monotonic()
+            if timeout > 0:
+                dev.readinto(self._buf, end=1)
+                # 0 = conversion in progress, 1 = conversion done
+                while self._buf[0] == 0x00:
+                    if time.monotonic() - start_time > timeout:
+                        raise RuntimeError(
+                            'Timeout waiting for conversion to complete.')
+                    dev.readinto(self._buf, end=1)
+        return time.monotonic() - start_time
+
+    def _read_temp(self):
+        buf = self._read_scratch()
+        if self._address.family_code == 0x10:
+            if buf[1]:
+                t = buf[0] >> 1 | 0x80
+                t = -((~t + 1) & 0xFF)
+            else:
+                t = buf[0] >> 1
+            return t - 0.25 + (buf[7] - buf[6]) / buf[7]
+        t = buf[1] << 8 | buf[0]
+        if t & 0x8000:  # sign bit set
+            t = -((t ^ 0xFFFF) + 1)
+        return t / 16
+
+    def _read_scratch(self):
+        with self._device as dev:
+            dev.write(_RD_SCRATCH)
+            dev.readinto(self._buf)
+        return self._buf
+
+    def start_temperature_read(self):
+        self._convert_temp(timeout=0)
+        return self._conv_delay
+
+    def read_temperature(self):
+        return self._read_temp()
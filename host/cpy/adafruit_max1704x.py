@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for adafruit_max1704x. After wake(), the gauge needs some
+# settling time before cell_voltage reflects a fresh ADC conversion. Reading
+# early returns the stale value from before hibernation.
+import _world
+from _world import hardware
+
+
+# Time from wake() until the first fresh voltage conversion is ready
+SETTLE_S = 0.5
+
+
+class MAX17048:
+
+    def __init__(self, i2c_bus, address=0x36):
+        self.i2c_device = i2c_bus
+        self._woke_at = None
+
+    @hardware
+    def wake(self):
+        self._woke_at = _world.world.clock.monotonic()
+
+    def hibernate(self):
+        self._woke_at = None
+
+    @property
+    def hibernating(self):
+        return self._woke_at is None
+
+    @property
+    @hardware
+    def cell_voltage(self):
+        w = _world.world
+        volts = w.battery.volts
+        settled = (
+            self._woke_at is not None
+            and w.clock.monotonic() - self._woke_at >= SETTLE_S
+        )
+        if not settled:
+            # Stale reading from before the cell discharged as far
+            volts += 0.02
+        # The MAX17048 VCELL LSB is 78.125 µV
+        return round(volts / 78.125e-6) * 78.125e-6
+
+    @property
+    def cell_percent(self):
+        b = _world.world.battery
+        return 100.0 * max(0.0, 1.0 - b.used_mah / b.capacity_mah)
@@ -0,0 +1,150 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for adafruit_onewire.bus, talking to the simulated DS18B20s
+# in _world at the level of 1-wire ROM and function command bytes. Bus time
+# is modeled at standard speed (about 0.56 ms per byte, 1 ms per reset).
+import _world
+from _world import crc8, hardware
+
+
+_BYTE_S = 8 * 70e-6
+_RESET_S = 960e-6
+
+
+class OneWireError(Exception):
+    pass
+
+
+class OneWireAddress:
+
+    def __init__(self, rom):
+        self._rom = rom
+
+    @property
+    def rom(self):
+        return self._rom
+
+    @property
+    def serial_number(self):
+        return self._rom[1:7]
+
+    @property
+    def family_code(self):
+        return self._rom[0]
+
+    @property
+    def crc(self):
+        return self._rom[7]
+
+
+class OneWireBus:
+
+    def __init__(self, pin):
+        self.pin = pin
+        self._state = 'idle'
+        self._selected = []
+        self._rx = bytearray()
+        self._tx = b''
+
+    def deinit(self):
+        pass
+
+    @hardware
+    def reset(self, required=False):
+        w = _world.world
+        w.sleep(_RESET_S)
+        self._state = 'rom'
+        self._selected = []
+        self._rx = bytearray()
+        self._tx = b''
+        present = any(d.present for d in w.onewire)
+        if required and not present:
+            raise OneWireError('No presence pulse found. Check devices and wiring.')
+        return present
+
+    @hardware
+    def write(self, buf, *, start=0, end=None):
+        data = bytes(buf[start:end])
+        _world.world.sleep(_BYTE_S * len(data))
+        for b in data:
+            self._write_byte(b)
+
+    def _write_byte(self, b):
+        w = _world.world
+        devices = [d for d in w.onewire if d.present]
+        if self._state == 'rom':
+            if b == 0xCC:       # skip ROM
+                self._selected = devices
+                self._state = 'func'
+            elif b == 0x55:     # match ROM
+                self._state = 'match'
+                self._rx = bytearray()
+            else:
+                self._state = 'idle'
+        elif self._state == 'match':
+            self._rx.append(b)
+            if len(self._rx) == 8:
+                rom = bytes(self._rx)
+                self._selected = [d for d in devices if d.rom == rom]
+                self._state = 'func'
+        elif self._state == 'func':
+            if b == 0x44:       # convert T
+                now = w.clock.monotonic()
+                for d in self._selected:
+                    d.start_conversion(now, w.temperature_c())
+                self._state = 'convert'
+            elif b == 0xBE:     # read scratchpad
+                self._tx = self._wired_and(
+                    [d.scratchpad() for d in self._selected], 9)
+                self._state = 'read'
+            elif b == 0x4E:     # write scratchpad
+                self._rx = bytearray()
+                self._state = 'write_sp'
+            else:
+                self._state = 'idle'
+        elif self._state == 'write_sp':
+            self._rx.append(b)
+            if len(self._rx) == 3:
+                for d in self._selected:
+                    (d.th, d.tl, d.config) = self._rx
+                self._state = 'idle'
+
+    def _wired_and(self, frames, n):
+        # Several devices talking at once pull the bus low together
+        out = bytearray([0xFF] * n)
+        for f in frames:
+            for i in range(n):
+                out[i] &= f[i]
+        return bytes(out)
+
+    @hardware
+    def readinto(self, buf, *, start=0, end=None):
+        w = _world.world
+        end = len(buf) if end is None else end
+        w.sleep(_BYTE_S * (end - start))
+        for i in range(start, end):
+            if self._state == 'convert':
+                now = w.clock.monotonic()
+                busy = any(d.busy(now) for d in self._selected)
+                buf[i] = 0x00 if busy else 0xFF
+            elif self._state == 'read' and self._tx:
+                buf[i] = self._tx[0]
+                self._tx = self._tx[1:]
+            else:
+                buf[i] = 0xFF
+
+    @hardware
+    def scan(self):
+        # The search algorithm itself isn't simulated, but its bus time is:
+        # each device costs one reset, one command byte, and 64 triplets.
+        w = _world.world
+        found = []
+        for d in w.onewire:
+            w.sleep(_RESET_S + _BYTE_S + 64 * 3 * 70e-6)
+            if d.present:
+                found.append(OneWireAddress(d.rom))
+        return found
+
+    @staticmethod
+    def crc8(data):
+        return crc8(data)
@@ -0,0 +1,33 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for adafruit_onewire.device
+
+_MATCH_ROM = b'\x55'
+
+
+class OneWireDevice:
+
+    def __init__(self, bus, address):
+        self._bus = bus
+        self._address = address
+
+    def __enter__(self):
+        self._select_rom()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def readinto(self, buf, *, start=0, end=None):
+        self._bus.readinto(buf, start=start, end=end)
+        if start == 0 and end is None and len(buf) >= 8:
+            if self._bus.crc8(buf):
+                raise RuntimeError('CRC error.')
+
+    def write(self, buf, *, start=0, end=None):
+        return self._bus.write(buf, start=start, end=end)
+
+    def _select_rom(self):
+        self._bus.reset()
+        self.write(_MATCH_ROM)
+        self.write(self._address.rom)
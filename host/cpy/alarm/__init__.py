@@ -0,0 +1,50 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for the CircuitPython alarm module
+import _world
+from _world import DeepSleep, SleepMemory
+
+
+class _SleepMemoryProxy:
+    # Forward to the current world's sleep memory, so `from alarm import
+    # sleep_memory` keeps working across emulator.reset_world()
+
+    def __len__(self):
+        return len(_world.world.sleep_memory)
+
+    def __getitem__(self, key):
+        return _world.world.sleep_memory[key]
+
+    def __setitem__(self, key, val):
+        _world.world.sleep_memory[key] = val
+
+
+sleep_memory = _SleepMemoryProxy()
+
+# The alarm that caused the most recent wake (None on power up)
+wake_alarm = None
+
+
+def _earliest(alarms):
+    # Return (alarm, monotonic_time) for the first TimeAlarm to expire
+    from alarm.time import TimeAlarm
+    timed = [a for a in alarms if isinstance(a, TimeAlarm)]
+    if not timed:
+        raise ValueError('no TimeAlarm (pin alarms are not simulated)')
+    a = min(timed, key=lambda a: a.monotonic_time)
+    return (a, a.monotonic_time)
+
+
+def light_sleep_until_alarms(*alarms):
+    from _world import Battery
+    (a, t) = _earliest(alarms)
+    w = _world.world
+    dt = max(0.0, t - w.clock.monotonic())
+    w.clock.advance(dt)
+    w.battery.drain(dt, Battery.LIGHT_SLEEP_MA)
+    return a
+
+
+def exit_and_deep_sleep_until_alarms(*alarms, preserve_dios=()):
+    # The emulator catches this, models the sleep, then runs code.py again
+    raise DeepSleep(alarms)
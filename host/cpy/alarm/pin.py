@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for alarm.pin
+
+
+class PinAlarm:
+
+    def __init__(self, pin, value, edge=False, pull=False):
+        self.pin = pin
+        self.value = value
+        self.edge = edge
+        self.pull = pull
@@ -0,0 +1,15 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for alarm.time
+import _world
+
+
+class TimeAlarm:
+
+    def __init__(self, *, monotonic_time=None, epoch_time=None):
+        if (monotonic_time is None) == (epoch_time is None):
+            raise ValueError('need exactly one of monotonic_time, epoch_time')
+        if epoch_time is not None:
+            clock = _world.world.clock
+            monotonic_time = clock.monotonic() + epoch_time - clock.time()
+        self.monotonic_time = monotonic_time
@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for analogio. On QT Py boards, A3 reads the simulated battery
+# through a divider of two equal resistors, with some ADC noise.
+import random
+
+import _world
+from _world import hardware
+
+
+# Divider ratio of the simulated BAT to A3 wiring
+A3_DIVIDER = 2.0
+
+# Time for one ESP32-S3 ADC conversion
+READ_S = 40e-6
+
+# Standard deviation of the ADC noise (Volts at the pin)
+NOISE_V = 0.008
+
+
+class AnalogIn:
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.reference_voltage = 3.3
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+    def deinit(self):
+        pass
+
+    @property
+    @hardware
+    def value(self):
+        w = _world.world
+        w.sleep(READ_S)
+        volts = 0.0
+        if self.pin.name == 'A3':
+            volts = w.battery.volts / A3_DIVIDER + random.gauss(0, NOISE_V)
+        volts = min(max(volts, 0.0), self.reference_voltage)
+        return round(volts / self.reference_voltage * 65535)
@@ -0,0 +1,48 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for the board module. Pin names depend on which board the
+# simulated world is pretending to be.
+import _world
+
+
+class Pin:
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return 'board.' + self.name
+
+
+class I2C:
+    # Only needs to be a context manager that the fake drivers accept
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+    def deinit(self):
+        pass
+
+
+_PINS = {
+    'adafruit_feather_esp32s3_nopsram': (
+        'A0', 'A1', 'A2', 'A3', 'A4', 'A5', 'LED', 'NEOPIXEL',
+        'NEOPIXEL_POWER',
+    ),
+    'adafruit_metro_esp32s3': (
+        'A0', 'A1', 'A2', 'A3', 'A4', 'A5', 'LED', 'NEOPIXEL',
+    ),
+    'adafruit_qtpy_esp32s3_nopsram': (
+        'A0', 'A1', 'A2', 'A3', 'NEOPIXEL', 'NEOPIXEL_POWER',
+    ),
+    'adafruit_qtpy_esp32s3_4mbflash_2mbpsram': (
+        'A0', 'A1', 'A2', 'A3', 'NEOPIXEL', 'NEOPIXEL_POWER',
+    ),
+}
+
+board_id = _world.world.board_id
+for _name in _PINS[board_id]:
+    globals()[_name] = Pin(_name)
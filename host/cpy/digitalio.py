@@ -0,0 +1,53 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for digitalio. Reading A0 with a pull up reports the state of
+# the simulated USB-mode jumper.
+import _world
+
+
+class Direction:
+    INPUT = 'INPUT'
+    OUTPUT = 'OUTPUT'
+
+
+class Pull:
+    UP = 'UP'
+    DOWN = 'DOWN'
+
+
+class DigitalInOut:
+
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self._value = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+    def deinit(self):
+        pass
+
+    def switch_to_output(self, value=False, drive_mode=None):
+        self.direction = Direction.OUTPUT
+        self._value = value
+
+    def switch_to_input(self, pull=None):
+        self.direction = Direction.INPUT
+        self.pull = pull
+
+    @property
+    def value(self):
+        if self.direction == Direction.INPUT and self.pin.name == 'A0':
+            return not _world.world.a0_grounded
+        if self.direction == Direction.INPUT:
+            return self.pull == Pull.UP
+        return self._value
+
+    @value.setter
+    def value(self, val):
+        self._value = val
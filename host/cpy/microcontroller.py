@@ -0,0 +1,28 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for the microcontroller module (the CPU UID and nvm)
+import _world
+
+
+class Processor:
+
+    @property
+    def uid(self):
+        return bytearray(_world.world.uid)
+
+
+class _NVM:
+    # Indexing and slicing goes to the simulated board's nvm bytearray
+
+    def __len__(self):
+        return len(_world.world.nvm)
+
+    def __getitem__(self, key):
+        return _world.world.nvm[key]
+
+    def __setitem__(self, key, val):
+        _world.world.nvm[key] = val
+
+
+cpu = Processor()
+nvm = _NVM()
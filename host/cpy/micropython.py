@@ -0,0 +1,7 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for the micropython module
+
+
+def const(x):
+    return x
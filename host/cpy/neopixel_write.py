@@ -0,0 +1,10 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for neopixel_write
+import _world
+from _world import hardware
+
+
+@hardware
+def neopixel_write(pin, buf):
+    _world.world.neopixel_writes += 1
@@ -0,0 +1,19 @@
+# SPDX-License-Identifier: MIT
+#
+# Host stand-in for the rtc module. The RTC runs in UTC with no timezone,
+# like the ESP32-S3 RTC under CircuitPython.
+import calendar
+import time
+
+import _world
+
+
+class RTC:
+
+    @property
+    def datetime(self):
+        return time.struct_time(time.gmtime(_world.world.clock.time()))
+
+    @datetime.setter
+    def datetime(self, val):
+        _world.world.clock.set_time(calendar.timegm(tuple(val)[:6]))
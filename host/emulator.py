@@ -0,0 +1,252 @@
+# SPDX-License-Identifier: MIT
+"""
+Run the logger firmware unmodified under CPython, against simulated hardware.
+
+The stand-in CircuitPython modules live in host/cpy/ and share one simulated
+board (sleep memory, RTC, battery, 1-wire probes, and a temporary directory
+standing in for the CIRCUITPY drive) defined in host/cpy/_world.py.
+This module puts them on sys.path, swaps the host `time` functions for ones
+driven by the simulated clock, and knows how to run code.py for one wake cycle
+the way the ESP32 does after each deep sleep.
+
+Example, from the repo root:
+
+    import sys; sys.path.insert(0, 'host')
+    import emulator
+    emulator.reset_world()
+    for _ in range(100):
+        emulator.wake()
+    with emulator.repl():
+        emulator.load('util').dump()
+"""
+import ast
+from configparser import ConfigParser
+from contextlib import contextmanager, redirect_stdout
+import calendar
+import importlib.abc
+import importlib.util
+import os
+import sys
+import time
+from types import ModuleType
+
+
+HOST_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(HOST_DIR)
+CPY_DIR = os.path.join(HOST_DIR, 'cpy')
+
+if CPY_DIR not in sys.path:
+    sys.path.insert(0, CPY_DIR)
+
+import _world
+from _world import Battery, DeepSleep, World
+
+
+def _project_modules():
+    # Device modules are the .py files that bundle_manifest.cfg copies to
+    # CIRCUITPY, minus the ones CircuitPython runs by itself
+    config = ConfigParser(allow_no_value=True)
+    config.read(os.path.join(REPO_DIR, 'bundle_manifest.cfg'))
+    names = set()
+    for (k, v) in config.items('root'):
+        if k.endswith('.py') and k not in ('code.py', 'boot.py'):
+            names.add(k[:-3])
+    return names
+
+PROJECT_MODULES = _project_modules()
+
+# Stand-in modules that get re-imported on every simulated reset
+FAKE_MODULES = set(
+    n[:-3] if n.endswith('.py') else n
+    for n in os.listdir(CPY_DIR)
+    if not n.startswith('_')
+)
+
+
+def hoist_consts(module, tree):
+    # MicroPython folds const() names at parse time across the whole module,
+    # so methods may use class level consts as bare names (SleepMem does).
+    # CPython scoping doesn't allow that, so copy them to module globals.
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        cls = getattr(module, node.name)
+        for stmt in node.body:
+            if not (isinstance(stmt, ast.Assign)
+                    and isinstance(stmt.value, ast.Call)
+                    and getattr(stmt.value.func, 'id', None) == 'const'):
+                continue
+            for t in stmt.targets:
+                if isinstance(t, ast.Name):
+                    module.__dict__.setdefault(t.id, getattr(cls, t.id))
+
+def exec_source(module, path):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        source = f.read()
+    tree = ast.parse(source, path)
+    code = compile(tree, path, 'exec')
+    module.__file__ = path
+    try:
+        exec(code, module.__dict__)
+    finally:
+        hoist_consts(module, tree)
+
+
+class _ProjectLoader(importlib.abc.Loader):
+
+    def create_module(self, spec):
+        return None
+
+    def exec_module(self, module):
+        exec_source(module, module.__spec__.origin)
+
+
+class _ProjectFinder(importlib.abc.MetaPathFinder):
+    # Import the device modules from the repo root with const() hoisting
+
+    def find_spec(self, name, path=None, target=None):
+        if name not in PROJECT_MODULES:
+            return None
+        origin = os.path.join(REPO_DIR, name + '.py')
+        return importlib.util.spec_from_file_location(
+            name, origin, loader=_ProjectLoader())
+
+if not any(isinstance(f, _ProjectFinder) for f in sys.meta_path):
+    sys.meta_path.insert(0, _ProjectFinder())
+
+
+def reset_world(**kwargs):
+    # Start a fresh simulated board. See _world.World for the options.
+    _world.world = World(**kwargs)
+    purge()
+    return _world.world
+
+def world():
+    return _world.world
+
+def purge():
+    # Forget everything a reset clears: device modules and stand-ins
+    for name in list(sys.modules):
+        root = name.split('.')[0]
+        if root in PROJECT_MODULES or root in FAKE_MODULES:
+            del sys.modules[name]
+
+
+@contextmanager
+def patched_time():
+    # Point the host time functions at the simulated clock. Like the ESP32
+    # RTC, time.localtime() and time.mktime() have no timezone.
+    clock = _world.world.clock
+    saved = {
+        k: getattr(time, k)
+        for k in ('sleep', 'time', 'monotonic', 'monotonic_ns', 'localtime',
+                  'mktime')
+    }
+    time.sleep = lambda s: _world.world.sleep(s)
+    time.time = clock.time
+    time.monotonic = clock.monotonic
+    time.monotonic_ns = lambda: int(clock.monotonic() * 1e9)
+    time.localtime = lambda t=None: time.gmtime(
+        clock.time() if t is None else t)
+    time.mktime = lambda t: calendar.timegm(tuple(t)[:6])
+    try:
+        yield
+    finally:
+        for (k, v) in saved.items():
+            setattr(time, k, v)
+
+@contextmanager
+def repl(stdout=None):
+    # Simulate a REPL session on a freshly reset board: the clock runs and
+    # device modules import fresh. Pass stdout to capture printed output.
+    purge()
+    clock = _world.world.clock
+    cwd = os.getcwd()
+    with patched_time():
+        os.chdir(_world.world.circuitpy.name)
+        clock.run()
+        try:
+            if stdout is None:
+                yield
+            else:
+                with redirect_stdout(stdout):
+                    yield
+        finally:
+            clock.stop()
+            os.chdir(cwd)
+
+def load(name):
+    # Import a device module by name, e.g. load('util'). Use inside repl().
+    return importlib.import_module(name)
+
+
+class CountingWriter:
+    # File-like sink for print() that only counts what was written
+
+    def __init__(self):
+        self.chars = 0
+        self.lines = 0
+
+    def write(self, s):
+        self.chars += len(s)
+        self.lines += s.count('\n')
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class WakeStats:
+    # What one simulated wake cycle cost
+
+    def __init__(self, awake_s, modeled_s, cpu_s, asleep_s, bytes_written,
+                 bytes_read, printed):
+        self.awake_s = awake_s
+        self.modeled_s = modeled_s
+        self.cpu_s = cpu_s
+        self.asleep_s = asleep_s
+        self.bytes_written = bytes_written
+        self.bytes_read = bytes_read
+        self.printed = printed
+
+
+def run_code():
+    # Execute code.py the way CircuitPython does after a reset. It isn't
+    # registered in sys.modules because `code` would shadow the stdlib.
+    module = ModuleType('code')
+    exec_source(module, os.path.join(REPO_DIR, 'code.py'))
+
+def wake(stdout=None):
+    # Run one wake cycle: code.py until it requests deep sleep, then model the
+    # deep sleep until its TimeAlarm. Returns a WakeStats.
+    w = _world.world
+    sm = w.sleep_memory
+    (written, read) = (sm.bytes_written, sm.bytes_read)
+    (modeled, cpu) = (w.clock.modeled, w.clock.cpu)
+    sink = CountingWriter() if stdout is None else stdout
+    alarms = None
+    with repl(stdout=sink):
+        try:
+            run_code()
+        except DeepSleep as e:
+            alarms = e.alarms
+    if alarms is None:
+        raise RuntimeError('code.py finished without requesting deep sleep')
+    cpu_s = w.clock.cpu - cpu
+    modeled_s = w.clock.modeled - modeled
+    w.battery.drain(cpu_s, Battery.ACTIVE_MA)
+    # Sleep until the first TimeAlarm (pin alarms are not simulated)
+    t0 = w.clock.monotonic()
+    timed = [a for a in alarms if hasattr(a, 'monotonic_time')]
+    w.clock.advance_to(min(a.monotonic_time for a in timed))
+    asleep_s = w.clock.monotonic() - t0
+    w.battery.drain(asleep_s, Battery.DEEP_SLEEP_MA)
+    return WakeStats(
+        awake_s=modeled_s + cpu_s,
+        modeled_s=modeled_s,
+        cpu_s=cpu_s,
+        asleep_s=asleep_s,
+        bytes_written=sm.bytes_written - written,
+        bytes_read=sm.bytes_read - read,
+        printed=getattr(sink, 'chars', 0),
+    )
@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: MIT
+"""
+Serve a fake CircuitPython serial REPL on a pseudo-terminal, for testing
+host/fleet.py without logger hardware.
+
+Each fake board runs the unmodified logger code under host/emulator.py: it
+simulates some wake cycles to fill the log, sets its RTC a few seconds off
+from host local time, then pretends to sit in admin mode. Like a real board,
+Ctrl-C stops the code, any key enters the REPL, lines typed at the `>>> `
+prompt run with their output sent back, and Ctrl-D does a soft reboot.
+
+    python3 host/fakerepl.py [--count N] [--wakes N] [--drift S]
+                             [--line-delay S]
+
+This prints the pty device path of each fake board on one line, then serves
+until interrupted, so a test run looks like:
+
+    python3 host/fakerepl.py --count 12 > ports.txt &
+    python3 host/fleet.py --out /tmp/fleet $(cat ports.txt)
+
+Board i (counting from 0) gets a UID ending in i and an RTC that is
+`--drift` + i seconds fast. `--line-delay` slows each line of REPL output to
+mimic a board that takes a while to print a big log.
+"""
+import argparse
+import calendar
+import os
+import os.path
+import pty
+import subprocess
+import sys
+import time
+from time import sleep as host_sleep
+import traceback
+import tty
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import emulator
+
+
+# What a board prints when Ctrl-C stops code.py, and on entering the REPL.
+# PtyWriter turns the line endings into CRLF.
+STOPPED = (
+    '\nTraceback (most recent call last):\n'
+    '  File "code.py", line 1, in <module>\n'
+    'KeyboardInterrupt: \n\n'
+    'Code done running.\n\n'
+    'Press any key to enter the REPL. Use CTRL-D to reload.\n')
+BANNER = 'Adafruit CircuitPython 9.2.1 on 2024-11-20; %s with ESP32S3\n>>> '
+
+
+class PtyWriter:
+    # File-like stdout for the REPL session: CRLF line endings like the
+    # CircuitPython console, with an optional delay per line
+
+    def __init__(self, fd, line_delay=0.0):
+        self.fd = fd
+        self.line_delay = line_delay
+
+    def write(self, s):
+        data = s.replace('\n', '\r\n').encode('utf-8')
+        while data:
+            n = os.write(self.fd, data)
+            data = data[n:]
+        if self.line_delay:
+            host_sleep(self.line_delay * s.count('\n'))
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+def run_line(line, namespace, out):
+    # Run one line typed at the >>> prompt, printing results like the REPL
+    try:
+        code = compile(line, '<stdin>', 'single')
+        exec(code, namespace)
+    except SystemExit:
+        raise
+    except BaseException:
+        traceback.print_exc(file=out)
+
+def session(fd, out):
+    # Serve one REPL session, from the point where code.py is running in
+    # admin mode until a soft reboot (Ctrl-D at the prompt)
+    state = 'running'
+    (line, namespace) = (b'', {'__name__': '__main__'})
+    while True:
+        for b in os.read(fd, 1024):
+            if state == 'running':
+                if b == 0x03:
+                    out.write(STOPPED)
+                    state = 'stopped'
+            elif state == 'stopped':
+                out.write(BANNER % emulator.world().board_id)
+                state = 'repl'
+            elif b == 0x03:
+                line = b''
+                out.write('\n>>> ')
+            elif b == 0x04 and not line:
+                out.write('\nsoft reboot\n\n')
+                return
+            elif b in (0x08, 0x7F):
+                if line:
+                    line = line[:-1]
+                    os.write(fd, b'\x08 \x08')
+            elif b == 0x0D:
+                out.write('\n')
+                if line.strip():
+                    run_line(line.decode('utf-8', 'replace'), namespace, out)
+                line = b''
+                out.write('>>> ')
+            elif b >= 0x20:
+                line += bytes([b])
+                os.write(fd, bytes([b]))
+
+def serve(wakes, drift, line_delay, uid):
+    # Fill a fake board's log, then serve its REPL on a new pty forever
+    emulator.reset_world(uid=uid)
+    for _ in range(wakes):
+        emulator.wake()
+    # Like a board whose RTC was set by util.set_clock(), the RTC keeps
+    # local time with no timezone
+    w = emulator.world()
+    w.clock.set_time(calendar.timegm(time.localtime()) + drift)
+    (master, slave) = pty.openpty()
+    tty.setraw(slave)
+    tty.setraw(master)
+    print(os.ttyname(slave), flush=True)
+    out = PtyWriter(master, line_delay)
+    while True:
+        with emulator.repl(stdout=out):
+            session(master, out)
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('--count', type=int, default=1,
+                    help='number of fake boards (default: 1)')
+    ap.add_argument('--wakes', type=int, default=500,
+                    help='wake cycles to simulate before serving '
+                    '(default: 500)')
+    ap.add_argument('--drift', type=float, default=3.0,
+                    help='seconds the RTC of the first board is fast '
+                    '(default: 3)')
+    ap.add_argument('--line-delay', type=float, default=0.0,
+                    help='seconds to wait per line of output (default: 0)')
+    ap.add_argument('--index', type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.count == 1:
+        uid = bytes.fromhex('f412fa4b00') + bytes([args.index & 0xFF])
+        serve(args.wakes, args.drift + args.index, args.line_delay, uid)
+        return
+    # One process per board, since each emulated board is a global world
+    children = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--index', str(i),
+             '--wakes', str(args.wakes), '--drift', str(args.drift),
+             '--line-delay', str(args.line_delay)],
+            stdout=subprocess.PIPE, text=True)
+        for i in range(args.count)
+    ]
+    try:
+        paths = [c.stdout.readline().strip() for c in children]
+        print(' '.join(paths), flush=True)
+        for c in children:
+            c.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for c in children:
+            c.terminate()
+
+
+if __name__ == '__main__':
+    main()
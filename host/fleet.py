@@ -0,0 +1,231 @@
+# SPDX-License-Identifier: MIT
+"""
+Download the logs of many loggers at once over USB serial.
+
+Put every logger in admin mode (A0 jumpered to GND) and plug them all in,
+then run:
+
+    python3 host/fleet.py [PORT ...] [--out DIR] [--utc] [--timeout S]
+
+With no ports, this finds the attached ones (/dev/ttyACM* on Linux,
+/dev/tty.usbmodem* on macOS). For each board, in parallel, it breaks into the
+REPL with Ctrl-C, then runs util.now(), util.batt(), and util.dump(), like
+the manual log download procedure. Each log gets saved as
+<board_id>-<uid>.csv in the output directory, and a fleet.csv summary lists
+each board's RTC drift (board RTC minus host local time, in seconds), battery
+reading, row count, and download time. Boards talk to the host at the same
+time, so collecting the whole fleet takes about as long as the slowest board.
+
+This only needs the standard library (termios and asyncio), so it works on
+Linux and macOS without pyserial. host/fakerepl.py serves fake boards on
+pseudo-terminals for testing it without hardware.
+"""
+import argparse
+import asyncio
+import calendar
+import csv
+from glob import glob
+import os
+import os.path
+import sys
+import termios
+import time
+import tty
+
+
+# Where CircuitPython USB serial ports show up on Linux and macOS
+PORT_GLOBS = ('/dev/ttyACM*', '/dev/tty.usbmodem*')
+
+PROMPT = b'\r\n>>> '
+PRESS_ANY_KEY = b'Press any key to enter the REPL'
+
+# One line command that prints the board ID and CPU UID
+IDENTIFY = (
+    'import board, microcontroller, binascii; '
+    'print(board.board_id, binascii.hexlify(microcontroller.cpu.uid)'
+    '.decode())')
+
+
+class ReplError(Exception):
+    pass
+
+
+class Port:
+    # Nonblocking raw serial port read by the asyncio event loop
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(self.fd)
+        attrs = termios.tcgetattr(self.fd)
+        attrs[4] = attrs[5] = termios.B115200
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        self.buf = bytearray()
+        self.data = asyncio.Event()
+        self.eof = False
+        asyncio.get_running_loop().add_reader(self.fd, self._readable)
+
+    def _readable(self):
+        try:
+            chunk = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            chunk = b''
+        if not chunk:
+            # Unplugged. Stop watching, or the loop spins on the dead fd.
+            self.eof = True
+            asyncio.get_running_loop().remove_reader(self.fd)
+        self.buf += chunk
+        self.data.set()
+
+    async def write(self, data):
+        while data:
+            try:
+                n = os.write(self.fd, data)
+            except BlockingIOError:
+                n = 0
+            data = data[n:]
+            if data:
+                await asyncio.sleep(0.01)
+
+    async def read_until(self, *markers, timeout=10.0):
+        # Return everything up to and including the first marker found,
+        # leaving the rest buffered
+        deadline = asyncio.get_running_loop().time() + timeout
+        while True:
+            hits = [(i, m) for (i, m) in (
+                (self.buf.find(m), m) for m in markers) if i >= 0]
+            if hits:
+                (i, m) = min(hits)
+                out = bytes(self.buf[:i + len(m)])
+                del self.buf[:i + len(m)]
+                return out
+            if self.eof:
+                raise ReplError('port closed')
+            self.data.clear()
+            left = deadline - asyncio.get_running_loop().time()
+            if left <= 0:
+                raise ReplError('timed out waiting for %r' % (markers,))
+            try:
+                await asyncio.wait_for(self.data.wait(), left)
+            except asyncio.TimeoutError:
+                pass
+
+    def close(self):
+        if not self.eof:
+            asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+
+async def enter_repl(port):
+    # Interrupt code.py (admin mode loop) and get to the >>> prompt
+    await port.write(b'\r\x03\x03')
+    got = await port.read_until(PROMPT, PRESS_ANY_KEY)
+    if got.endswith(PRESS_ANY_KEY):
+        await port.write(b'\r')
+        await port.read_until(PROMPT)
+    # Drop anything left from before, then sync on a fresh prompt
+    await asyncio.sleep(0.1)
+    port.buf.clear()
+    await port.write(b'\r')
+    await port.read_until(PROMPT)
+
+async def run(port, command, timeout=10.0):
+    # Run a one line command at the prompt and return what it printed
+    await port.write(command.encode('utf-8') + b'\r')
+    got = await port.read_until(PROMPT, timeout=timeout)
+    text = got[:-len(PROMPT)].decode('utf-8', 'replace')
+    # The first line is the REPL echoing the command
+    lines = text.split('\r\n')[1:]
+    if any(l.startswith('Traceback (most recent call last)') for l in lines):
+        raise ReplError('%s failed: %s' % (command, lines[-1]))
+    return lines
+
+def host_now(utc):
+    # Host time on the same scale as a board RTC (local time, no timezone,
+    # unless the boards were set to UTC)
+    t = time.time()
+    if utc:
+        return t
+    return calendar.timegm(time.localtime(t)) + (t % 1)
+
+async def collect(path, out_dir, utc, timeout):
+    # Download one board. Returns a dict for the fleet.csv summary.
+    t0 = time.monotonic()
+    info = {'port': path, 'board': '', 'rtc': '', 'rtc_drift_s': '',
+            'battery': '', 'rows': '', 'seconds': '', 'error': ''}
+    port = None
+    try:
+        port = Port(path)
+        await enter_repl(port)
+        (board_id, uid) = (await run(port, IDENTIFY))[0].split()
+        info['board'] = '%s-%s' % (board_id, uid)
+        await run(port, 'import time, util')
+        # util.now() returns a string, which the REPL prints with quotes
+        info['rtc'] = ' '.join(await run(port, 'util.now()')).strip("'")
+        # Compare with host time halfway through the round trip. The board
+        # reports whole seconds, so on average it's half a second behind.
+        h0 = host_now(utc)
+        board_t = int((await run(port, 'print(time.time())'))[0])
+        h1 = host_now(utc)
+        info['rtc_drift_s'] = '%.1f' % (board_t + 0.5 - (h0 + h1) / 2)
+        info['battery'] = ' '.join(await run(port, 'util.batt()'))
+        lines = await run(port, 'util.dump()', timeout=timeout)
+        rows = [l for l in lines if l and not l.startswith('#')]
+        csv_path = os.path.join(out_dir, info['board'] + '.csv')
+        with open(csv_path, 'w') as f:
+            f.write('\n'.join(rows) + '\n')
+        info['rows'] = max(0, len(rows) - 1)
+    except (OSError, ReplError, ValueError, IndexError) as e:
+        info['error'] = str(e) or type(e).__name__
+    finally:
+        if port is not None:
+            port.close()
+    info['seconds'] = '%.1f' % (time.monotonic() - t0)
+    return info
+
+async def collect_all(paths, out_dir, utc, timeout):
+    return await asyncio.gather(
+        *(collect(p, out_dir, utc, timeout) for p in paths))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('ports', nargs='*', metavar='PORT',
+                    help='serial port(s) (default: find them)')
+    ap.add_argument('--out', default='.',
+                    help='directory for the CSV files (default: .)')
+    ap.add_argument('--utc', action='store_true',
+                    help='board RTCs were set to UTC rather than local time')
+    ap.add_argument('--timeout', type=float, default=600.0,
+                    help='seconds to allow for each util.dump() '
+                    '(default: 600)')
+    args = ap.parse_args()
+    ports = args.ports or sorted(p for g in PORT_GLOBS for p in glob(g))
+    if not ports:
+        sys.exit('ERROR: no serial ports found')
+    os.makedirs(args.out, exist_ok=True)
+    t0 = time.monotonic()
+    results = asyncio.run(collect_all(ports, args.out, args.utc,
+                                      args.timeout))
+    fields = ['port', 'board', 'rtc', 'rtc_drift_s', 'battery', 'rows',
+              'seconds', 'error']
+    with open(os.path.join(args.out, 'fleet.csv'), 'w', newline='') as f:
+        w = csv.DictWriter(f, fields)
+        w.writeheader()
+        w.writerows(results)
+    print('%-22s %-48s %7s %10s %6s %6s' % (
+        'port', 'board', 'drift s', 'battery', 'rows', 's'))
+    for r in results:
+        print('%-22s %-48s %7s %10s %6s %6s %s' % (
+            r['port'], r['board'], r['rtc_drift_s'], r['battery'],
+            r['rows'], r['seconds'], r['error']))
+    failed = sum(1 for r in results if r['error'])
+    print('%d boards in %.1f s, %d failed' % (
+        len(results), time.monotonic() - t0, failed))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
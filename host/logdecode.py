@@ -0,0 +1,180 @@
+# SPDX-License-Identifier: MIT
+"""
+Decode the output of util.dump_binary() into CSV or columnar JSON.
+
+Save everything the serial terminal printed for util.dump_binary() to a text
+file (REPL prompts and other noise are fine), then run:
+
+    python3 host/logdecode.py capture.txt > log.csv
+
+If the logger spilled part of its log to flash, also copy log.bin from the
+CIRCUITPY drive and pass it with --flash log.bin to merge both parts.
+
+If any chunks are missing or fail their CRC32 check, this prints the
+util.dump_binary(chunks=[...]) call that resends just those chunks. Append the
+resent output to the capture file (or pass both files) and run it again.
+
+The sleep memory image gets decoded by the same SleepMem class that wrote it,
+running under host/emulator.py, so the record layout constants (DATA,
+TIME_SHIFT, the scaled cV offset, record formats) can't drift out of sync.
+"""
+import argparse
+from binascii import a2b_base64, crc32, unhexlify
+import io
+import json
+import os.path
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import emulator
+
+
+BIN_RE = re.compile(r'#BIN (\S+) (\d+) (\d+) (\d+) (base64|hex)\s*$')
+CHUNK_RE = re.compile(r'(\d+) ([0-9a-f]{8}) ([0-9A-Za-z+/=]*)\s*$')
+END_RE = re.compile(r'#END ([0-9a-f]{8})\s*$')
+
+
+class Capture:
+    # Chunks of one sleep memory image, merged from one or more captures
+
+    def __init__(self):
+        self.board_id = None
+        self.end = self.size = self.count = None
+        self.encoding = None
+        self.image_crc = None
+        self.chunks = {}
+
+    def feed(self, text):
+        for line in text.splitlines():
+            m = BIN_RE.search(line)
+            if m:
+                meta = (m[1], int(m[2]), int(m[3]), int(m[4]), m[5])
+                if self.board_id is None:
+                    (self.board_id, self.end, self.size, self.count,
+                     self.encoding) = meta
+                elif meta[:4] != (self.board_id, self.end, self.size,
+                                  self.count):
+                    raise ValueError('capture mixes different dumps')
+                else:
+                    self.encoding = meta[4]
+                continue
+            m = END_RE.search(line)
+            if m:
+                self.image_crc = int(m[1], 16)
+                continue
+            m = CHUNK_RE.match(line.strip())
+            if m and self.board_id is not None:
+                self.add_chunk(int(m[1]), int(m[2], 16), m[3])
+
+    def add_chunk(self, seq, crc, payload):
+        if seq in self.chunks or not (0 <= seq < self.count):
+            return
+        try:
+            if self.encoding == 'hex':
+                data = unhexlify(payload)
+            else:
+                data = a2b_base64(payload)
+        except ValueError:
+            return
+        want = min(self.size, self.end - seq * self.size)
+        if len(data) == want and crc32(data) == crc:
+            self.chunks[seq] = data
+
+    def missing(self):
+        if self.count is None:
+            return None
+        return [i for i in range(self.count) if i not in self.chunks]
+
+    def image(self):
+        blob = b''.join(self.chunks[i] for i in range(self.count))
+        if self.image_crc is not None and crc32(blob) != self.image_crc:
+            raise ValueError('image CRC32 mismatch')
+        return blob
+
+
+def decode(blob, fill=True, flash=None):
+    # Return (header_info, records) for a sleep memory image, where records
+    # is a list of (timestamp, tempF, cV, tempF 2, ...). With fill=True, the
+    # samples skipped by change-driven logging get filled in like dump().
+    # Records from a spill file (flash path) go first, like dump().
+    w = emulator.reset_world()
+    w.sleep_memory.buf[:len(blob)] = blob
+    with emulator.repl(stdout=io.StringIO()):
+        sm = emulator.load('sleepmem').SleepMem()
+        (interval, max_gap) = sm.sampling
+        info = {
+            'end': sm.end, 'epoch': sm.epoch, 'format': sm.format,
+            'probes': sm.probes, 'interval': interval, 'max_gap': max_gap,
+            'seen': sm.seen,
+        }
+        if flash:
+            records = sm.all_records(os.path.abspath(flash))
+        else:
+            records = sm.records()
+        if fill:
+            util = emulator.load('util')
+            records = util.filled(records, interval, max_gap, sm.seen)
+        records = list(records)
+    return (info, records)
+
+def write_csv(info, records, out):
+    # Same layout as util.dump(), so downstream tools see no difference
+    with emulator.repl():
+        util = emulator.load('util')
+        (header, line) = util.csv_format(info['probes'])
+        print(header, file=out)
+        for row in util.rows(records):
+            print(line % row, file=out)
+
+def write_columns(board_id, info, records, out):
+    cols = {
+        'board_id': board_id,
+        'epoch': info['epoch'],
+        'format': info['format'],
+        'timestamp': [r[0] for r in records],
+        'tempF': [r[1] for r in records],
+        'cV': [r[2] for r in records],
+    }
+    for p in range(2, info['probes'] + 1):
+        cols['tempF_%d' % p] = [r[p + 1] for r in records]
+    json.dump(cols, out)
+    out.write('\n')
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    ap.add_argument('capture', nargs='+',
+                    help='text file(s) captured from util.dump_binary()')
+    ap.add_argument('--columns', action='store_true',
+                    help='write columnar JSON instead of CSV')
+    ap.add_argument('--flash', metavar='LOG_BIN',
+                    help='log.bin spill file copied from CIRCUITPY')
+    ap.add_argument('--raw', action='store_true',
+                    help="don't fill in samples skipped by change-driven "
+                    'logging')
+    args = ap.parse_args()
+    cap = Capture()
+    for path in args.capture:
+        with open(path, encoding='utf-8', errors='replace') as f:
+            cap.feed(f.read())
+    missing = cap.missing()
+    if missing is None:
+        sys.exit('ERROR: no #BIN header found')
+    if missing:
+        print('missing or bad chunks: %d of %d' % (len(missing), cap.count),
+              file=sys.stderr)
+        print('resend them from the REPL with:', file=sys.stderr)
+        print('util.dump_binary(chunks=%s, size=%d, encoding=%r)' % (
+            missing, cap.size, cap.encoding), file=sys.stderr)
+        sys.exit(1)
+    (info, records) = decode(cap.image(), fill=not args.raw,
+                             flash=args.flash)
+    print('# %s: %d records' % (cap.board_id, len(records)), file=sys.stderr)
+    if args.columns:
+        write_columns(cap.board_id, info, records, sys.stdout)
+    else:
+        write_csv(info, records, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
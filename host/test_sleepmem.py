@@ -0,0 +1,324 @@
+# SPDX-License-Identifier: MIT
+"""
+Round-trip tests for the SleepMem log formats, run on the simulated board.
+
+Each test appends a repeatable pseudo-random series of samples (jittered
+intervals, skipped samples, long gaps, big temperature jumps, failed
+readings), then checks that decoding the log gives back exactly what went in,
+with times quantized to 32 seconds like the encoders do. Time range queries
+get checked against a brute-force filter of the whole log. A few tests run
+code.py wake cycles, for the change-driven logging that decides what gets
+appended.
+
+Usage:
+
+    python3 host/test_sleepmem.py
+
+or `pytest host`, which finds the same test_* functions. (Not `python3 -m
+pytest` from the repo root, where code.py shadows the standard library's
+`code` module.)
+"""
+import io
+import os.path
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import emulator
+
+
+INTERVAL = 1200
+MAX_GAP = 3 * 3600
+
+
+def session(**world):
+    # Start a fresh board and return a REPL session context for it
+    emulator.reset_world(**world)
+    return emulator.repl(stdout=io.StringIO())
+
+def new_log(fmt, probes=1, ring=False, sampling=(INTERVAL, MAX_GAP)):
+    # Return an empty SleepMem log with these settings. Use inside session().
+    sm = emulator.load('sleepmem').SleepMem()
+    sm.format = fmt
+    sm.ring = ring
+    sm.sampling = sampling
+    if fmt == 1:
+        sm.probes = probes
+    return sm
+
+def samples(rng, t, probes, n, gaps=0.02):
+    # Generate n (timestamp, [tempF, ...], cV) samples after time t, with a
+    # gaps fraction of them after a long gap
+    temps = [40 + 3 * p for p in range(probes)]
+    cV = 400
+    for _ in range(n):
+        r = rng.random()
+        if r < gaps:
+            t += rng.randint(4, 12) * 3600        # admin mode, dead battery
+        elif r < gaps + 0.13:
+            t += INTERVAL * rng.randint(2, 9)     # skipped by deadband
+        else:
+            t += INTERVAL + rng.randint(-15, 15)  # RTC and wake jitter
+        temps = [max(-100, min(120, f + rng.choice(
+            (0, 0, 0, 1, -1, 2, -3, 17, -25)))) for f in temps]
+        cV = max(271, min(429, cV + rng.choice((0, 0, 0, 1, -1, -2, 6))))
+        logged = list(temps)
+        if rng.random() < 0.01:
+            logged[rng.randrange(probes)] = -128  # probe read failed
+        yield (t, logged, 0 if rng.random() < 0.01 else cV)
+
+def expected(epoch, t, temps, cV):
+    # The record that decodes from a sample: time quantized to 32 seconds,
+    # and cV out of range (failed reading) stored as 270
+    return ((epoch + ((t - epoch) >> 5 << 5), temps[0],
+             cV if 270 < cV < 430 else 270) + tuple(temps[1:]))
+
+def fill(sm, rng, n, spill=0, epoch=None, gaps=0.02):
+    # Append n samples to sm, after its newest record, spilling to log.bin if
+    # spill is a block count. Returns the list of records that should decode.
+    # Pass the log's starting epoch when adding to a FMT_FIXED ring buffer,
+    # since its epoch moves.
+    epoch = sm.epoch if epoch is None else epoch
+    fixed = sm.format == 0
+    probes = 1 if fixed else sm.probes
+    last = sm.last_logged()
+    truth = []
+    t0 = last[0] if last else epoch
+    for (t, temps, cV) in samples(rng, t0, probes, n, gaps):
+        sm.append_data(t, temps[0] if fixed else temps, cV)
+        truth.append(expected(epoch, t, temps, cV))
+        if spill:
+            sm.spill('log.bin', spill)
+    return truth
+
+def check_ranges(sm, rng, full, queries=150):
+    # Compare all_records(start, end) with a brute-force filter of full
+    (t0, t1) = (full[0][0], full[-1][0])
+    for _ in range(queries):
+        a = rng.randint(t0 - 5000, t1 + 5000)
+        b = a + rng.randint(0, (t1 - t0) // 4)
+        (start, end) = rng.choice(((a, b), (a, None), (None, b)))
+        want = [r for r in full if (start is None or r[0] >= start)
+                and (end is None or r[0] <= end)]
+        got = list(sm.all_records(start=start, end=end))
+        assert got == want, (start, end, len(got), len(want))
+
+
+def test_fixed_round_trip():
+    rng = random.Random(1)
+    with session():
+        sm = new_log(0)
+        # No long gaps, since FMT_FIXED times only reach 24 days
+        truth = fill(sm, rng, 900, gaps=0)
+        assert list(sm.records()) == truth
+        assert sm.last_records(25) == truth[-25:]
+        check_ranges(sm, rng, truth)
+
+def test_fixed_full_log_stops():
+    rng = random.Random(2)
+    with session():
+        sm = new_log(0)
+        truth = fill(sm, rng, 1050, gaps=0)
+        got = list(sm.records())
+        # Records after the log filled up get dropped
+        assert 900 < len(got) < 1050
+        assert got == truth[:len(got)]
+
+def test_delta_round_trip():
+    rng = random.Random(3)
+    for sampling in ((INTERVAL, MAX_GAP), (0, 0)):
+        with session():
+            # (0, 0) is a log started by firmware without the SAMPLING field
+            sm = new_log(1, sampling=sampling)
+            truth = fill(sm, rng, 2500)
+            got = list(sm.records())
+            assert 1000 < len(got) < 2500
+            assert got == truth[:len(got)]
+            assert sm.last_records(70) == got[-70:]
+            (t, temps, cV) = sm.last_logged()
+            assert (t, temps[0], cV) == got[-1][:3]
+            check_ranges(sm, rng, got)
+
+def test_delta_multi_probe():
+    rng = random.Random(4)
+    for probes in (2, 3, 4):
+        with session(probes=probes):
+            sm = new_log(1, probes=probes)
+            truth = fill(sm, rng, 1500)
+            got = list(sm.records())
+            assert 500 < len(got) < 1500
+            assert len(got[0]) == 3 + probes - 1
+            assert got == truth[:len(got)]
+            assert sm.last_logged()[1] == [got[-1][1]] + list(got[-1][3:])
+            check_ranges(sm, rng, got)
+
+def test_ring_round_trip():
+    rng = random.Random(5)
+    for (fmt, probes) in ((0, 1), (1, 1), (1, 3)):
+        with session():
+            sm = new_log(fmt, probes=probes, ring=True)
+            (epoch, truth) = (sm.epoch, [])
+            for _ in range(6):
+                # Check after each round of appends, wrapped or not
+                truth += fill(sm, rng, 1500, epoch=epoch)
+                got = list(sm.records())
+                assert got and got == truth[-len(got):], (fmt, probes)
+                assert sm.last_records(40) == got[-40:]
+                check_ranges(sm, rng, got, queries=40)
+            assert sm.tail
+
+def test_spill_round_trip():
+    rng = random.Random(6)
+    for probes in (1, 2):
+        with session():
+            sm = new_log(1, probes=probes)
+            truth = fill(sm, rng, 6000, spill=8)
+            assert os.path.getsize('log.bin') > 8 * 64
+            assert list(sm.all_records()) == truth
+            for n in (1, 60, 500, len(truth) + 3):
+                assert sm.last_records(n) == truth[-n:]
+            check_ranges(sm, rng, truth)
+
+def test_spill_corrupt_segment():
+    rng = random.Random(7)
+    with session():
+        sm = new_log(1)
+        truth = fill(sm, rng, 3000, spill=8)
+        data = bytearray(open('log.bin', 'rb').read())
+        data[64 * 3 + 10] ^= 0xFF
+        with open('log.bin', 'wb') as f:
+            f.write(data)
+        got = list(sm.all_records())
+        # Only the bad segment (8 blocks of about 55 records) goes missing
+        assert len(truth) - 8 * 64 < len(got) < len(truth)
+        assert all(r in truth for r in got[:50])
+        assert got[-100:] == truth[-100:]
+
+def test_spill_reads_only_needed_segments():
+    rng = random.Random(12)
+    with session():
+        sm = new_log(1)
+        truth = fill(sm, rng, 6000, spill=8)
+        nsegs = os.path.getsize('log.bin') // (9 * 64)
+        (spill_blocks, read) = (sm.spill_blocks, [])
+        sm.spill_blocks = lambda f, seg: (
+            read.append(seg) or spill_blocks(f, seg))
+        # A start time halfway through only reads the segments from there on
+        start = truth[len(truth) // 2][0]
+        got = list(sm.all_records(start=start))
+        assert got == [r for r in truth if r[0] >= start]
+        assert 0 < len(read) <= nsegs // 2 + 1, (len(read), nsegs)
+        # The newest records only read the segments that hold them
+        del read[:]
+        assert sm.last_records(500) == truth[-500:]
+        assert 0 < len(read) <= 2
+        assert read == sorted(read, reverse=True)
+
+def test_set_clock_drops_old_spill():
+    rng = random.Random(8)
+    with session():
+        sm = new_log(1)
+        fill(sm, rng, 3000, spill=8)
+        util = emulator.load('util')
+        answers = iter(['y', '2025', '6', '1', '12', '0', '0'])
+        util.input = lambda prompt: next(answers)
+        util.set_clock()
+        # The previous log's spill file stays until the next spill replaces
+        # it, but isn't part of the new log
+        sm = new_log(1)
+        truth = fill(sm, rng, 5, spill=8)
+        assert os.path.getsize('log.bin') > 8 * 64
+        assert list(sm.all_records()) == truth
+        assert sm.last_records(50) == truth
+        truth += fill(sm, rng, 1000, spill=8)
+        assert not sm.spill_new
+        assert list(sm.all_records()) == truth
+
+def test_adjust_clock_drift():
+    rng = random.Random(9)
+    for (fmt, n) in ((1, 1200), (0, 800)):
+        for delta in (700, -700):
+            with session():
+                sm = new_log(fmt)
+                fill(sm, rng, n, gaps=0)
+                before = list(sm.records())
+                (epoch, now) = (sm.epoch, before[-1][0] + 600)
+                assert sm.adjust_clock(delta, now)
+                after = list(sm.records())
+                assert [r[1:] for r in after] == [r[1:] for r in before]
+                # Each record moves by its share of delta, give or take the
+                # 32 s rounding and (FMT_DELTA) moving whole blocks at once
+                for (a, b) in zip(before, after):
+                    share = delta * (a[0] - epoch) // (now - epoch)
+                    assert abs(b[0] - a[0] - share) <= 40, (a, b, share)
+                # The next record uses the corrected clock
+                after += fill(sm, rng, 50, gaps=0)
+                assert list(sm.records()) == after
+                assert [r[0] for r in after] == sorted(r[0] for r in after)
+                check_ranges(sm, rng, after, queries=50)
+
+def test_adjust_clock_keeps_order():
+    rng = random.Random(10)
+    with session():
+        sm = new_log(1)
+        fill(sm, rng, 1500, spill=8, gaps=0)
+        before = list(sm.all_records())
+        now = before[-1][0] + 600
+        # Only the records in sleep memory can move, and they span less than
+        # a day, so a day's correction would put them out of order
+        assert not sm.adjust_clock(-86400, now)
+        assert list(sm.all_records()) == before
+        assert not sm.adjust_clock(-3600, now, drift=False)
+        assert list(sm.all_records()) == before
+        assert sm.adjust_clock(-120, now)
+        after = list(sm.all_records())
+        assert [r[0] for r in after] == sorted(r[0] for r in after)
+        assert after[:-100] == before[:-100]
+
+def test_adjust_clock_offset():
+    rng = random.Random(11)
+    delta = -30 * 86400 + 77
+    for (fmt, ring) in ((1, False), (0, False), (0, True), (1, True)):
+        with session():
+            sm = new_log(fmt, ring=ring)
+            epoch = sm.epoch
+            fill(sm, rng, 3000 if ring else 800, epoch=epoch, gaps=0)
+            before = list(sm.records())
+            summary = sm.summary
+            now = before[-1][0] + 600
+            assert sm.adjust_clock(delta, now, drift=False)
+            after = list(sm.records())
+            assert after == [(r[0] + delta,) + r[1:] for r in before]
+            assert sm.summary[3] == summary[3] + delta
+            after += fill(sm, rng, 50, epoch=epoch + delta, gaps=0)
+            got = list(sm.records())
+            assert got == after[-len(got):], (fmt, ring)
+            check_ranges(sm, rng, got, queries=50)
+
+def test_deadband_probe_removed():
+    # With change-driven logging, unplugging the last probe has to log a
+    # record right away, though the probe list then comes back one shorter
+    w = emulator.reset_world(probes=2)
+    w.temperature_c = lambda: 12.0
+    for _ in range(4):
+        emulator.wake()
+    w.onewire.pop()
+    emulator.wake()
+    with emulator.repl(stdout=io.StringIO()):
+        sm = emulator.load('sleepmem').SleepMem()
+        recs = list(sm.records())
+    assert len(recs) == 2 and recs[0][3] != -128 and recs[1][3] == -128, recs
+    assert sm.seen - recs[-1][0] < 32
+
+
+def main():
+    tests = [(k, v) for (k, v) in sorted(globals().items())
+             if k.startswith('test_') and callable(v)]
+    for (name, fn) in tests:
+        fn()
+        print('ok', name)
+    print('%d tests passed' % len(tests))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,29 @@
 # SPDX-License-Identifier: MIT
+from alarm import light_sleep_until_alarms
+from alarm.time import TimeAlarm
 import board
 from digitalio import DigitalInOut
 from neopixel_write import neopixel_write
-from time import sleep
+from time import monotonic, sleep
+
+
+# Morse dot time in seconds
+#
+# ITU-R 1677 Morse Code Timing:  3 dots per dash, 1 dot symbol gap,
+# 3 dot character gap, 7 dot word gap
+#
+# WPM Calculations, PARIS method @ 50 dots per word:
+# - dot time = (60 s) / (50 dots) / wpm = 1.20/wpm s/dot
+# - 5 WPM: 1.2/5 = 0.24 s/dot
+# - 8 WPM: 1.2/8 = 0.15 s/dot
+#
+DOT = 0.17  # 7 WPM
 
 
 MORSE = {
     '^': (3, 1, 3, 1, 3),   # -.-.-  start of transmission prosign (CT, KA)
     '+': (1, 3, 1, 3, 1),   # .-.-.  end of transmission prosign
+    '-': (3, 1, 1, 1, 1, 3),  # -....-  minus sign (below 0 °F)
     '0': (3, 3, 3, 3, 3),   # -----
     '1': (1, 3, 3, 3, 3),   # .----
     '2': (1, 1, 3, 3, 3),   # ..---
@@ -36,6 +52,7 @@ class RedLED:
         self.hasled = hasattr(b, 'LED')
         self.hasneo = hasattr(b, 'NEOPIXEL') and hasattr(b, 'NEOPIXEL_POWER')
         self.value_ = False
+        self.grb_red = bytearray([0, 5, 0])  # red (GRB order)
         self.led = self.neo = self.neopow = None
         if self.hasled:
             # First choice: Board has an LED pin
@@ -75,10 +92,9 @@ class RedLED:
             # No LED pin, but board does have NEOPIXEL and NEOPIXEL_POWER pins
             if val:
                 # Set neopixel on red
-                grb_red = bytearray([0, 5, 0])  # red (GRB order)
                 self.neopow.value = True
-                sleep(0.001)  # wait 5ms for neopixel power to stabilize
-                neopixel_write(self.neo, grb_red)
+                sleep(0.001)  # wait 1ms for neopixel power to stabilize
+                neopixel_write(self.neo, self.grb_red)
             else:
                 # Set neopixel off
                 self.neopow.value = False
@@ -90,28 +106,45 @@ class RedLED:
     def morse_char(self, c):
         # Send character in morse code using the LED.
         # CAUTION: This uses a limited alphabet intended for numbers only.
-        #
-        # ITU-R 1677 Morse Code Timing:  3 dots per dash, 1 dot symbol gap,
-        # 3 dot character gap, 7 dot word gap
-        #
-        # WPM Calculations, PARIS method @ 50 dots per word:
-        # - dot time = (60 s) / (50 dots) / wpm = 1.20/wpm s/dot
-        # - 5 WPM: 1.2/5 = 0.24 s/dot
-        # - 8 WPM: 1.2/8 = 0.15 s/dot
-        #
-        dot = 0.17  # 7 WPM
-        slp_ = sleep
-        if c == ' ':
-            # Gap should be 7 dots worth, but assume this comes after a
-            # character that ended with a 3 dot gap. So, 3+4=7.
-            self.value = False
-            slp_(4 * dot)
-        elif c in MORSE:
-            # Loop over the dot and dash symbols of a character
-            for on_dots in MORSE[c]:
-                self.value = True   # on for 1 or 3 dot lengths
-                slp_(on_dots * dot)
-                self.value = False  # off for 1 dot length
-                slp_(dot)
-            # Finish the gap between characters (loop ended with 1, so 1+2=3)
-            slp_(2 * dot)
+        self.play(self.compile_morse(c))
+
+    def compile_morse(self, msg, dot=DOT):
+        # Compile msg into a flat schedule of alternating on and off times in
+        # seconds: [on, off, on, off, ...]. Doing this once per message keeps
+        # the per-symbol work during playback to a minimum.
+        # CAUTION: This uses a limited alphabet intended for numbers only.
+        sched = [0, 0]
+        for c in msg:
+            if c == ' ':
+                # Gap should be 7 dots worth, but assume this comes after a
+                # character that ended with a 3 dot gap. So, 3+4=7.
+                sched[-1] += 4 * dot
+            elif c in MORSE:
+                # On for 1 or 3 dot lengths, then off for 1 dot length
+                for on_dots in MORSE[c]:
+                    sched.append(on_dots * dot)
+                    sched.append(dot)
+                # Finish the gap between characters (1+2=3)
+                sched[-1] += 2 * dot
+        return sched
+
+    def play(self, sched, a0_gnd=None):
+        # Play a schedule from compile_morse(). The off gaps use light sleep
+        # to save power. If a0_gnd is given, this checks it between symbols
+        # and stops early (returning False) once the A0 jumper is removed.
+        # Times are kept as deadlines, so the LED power-up delay and loop
+        # overhead don't make the timing drift.
+        t = monotonic()
+        for i in range(0, len(sched), 2):
+            on = sched[i]
+            if on:
+                self.value = True
+                t += on
+                sleep(max(0, t - monotonic()))
+                self.value = False
+            t += sched[i+1]
+            if (a0_gnd is not None) and a0_gnd.value:
+                return False
+            if t > monotonic():
+                light_sleep_until_alarms(TimeAlarm(monotonic_time=t))
+        return True
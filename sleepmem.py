@@ -1,10 +1,75 @@
 # SPDX-License-Identifier: MIT
 from alarm import sleep_memory
+from binascii import crc32
 from micropython import const
 from struct import pack, unpack
 import time
 
 
+# Record format codes for the FORMAT header field. Zeroed sleep memory from an
+# older firmware reads as FMT_FIXED, so existing logs keep decoding correctly.
+FMT_FIXED = const(0)   # 4 bytes per record: 16-bit time, 8-bit temp, 8-bit cV
+FMT_DELTA = const(1)   # 64 byte blocks of keyframe + 1 byte delta records
+
+# Record tags for FMT_DELTA. Bytes 0x20..0x7F are compact deltas, 0x00 pads
+# the unused end of a block (zeroed memory is padding), 0x01..0x1F say how
+# many samples change-driven logging skipped before the next record, and
+# 0x80..0xFD are reserved.
+PAD = const(0x00)
+MAX_SKIP = const(0x1F)
+WIDE = const(0xFE)
+KEY = const(0xFF)
+
+# Full FMT_DELTA blocks can be moved out of sleep memory to this file on the
+# CIRCUITPY drive (see SleepMem.spill). The file is a series of segments, each
+# a 64 byte header followed by the blocks, so it grows in whole blocks.
+SPILL_FILE = 'log.bin'
+SPILL_MAGIC = b'SPL1'
+SPILL_FMT = '<4sIBBHHHI'  # magic, epoch, format, probes, interval, max gap,
+                          # block count, CRC32 of blocks
+
+# Layout of the SUMMARY header field (see SleepMem.summary)
+SUMMARY_FMT = '<HibIbIBHHHB'
+
+# Wake cycle phases timed by code.py when profiling is on. The last one is the
+# total awake time of code.py.
+PHASES = ('startup', 'temp start', 'batt start', 'wait', 'temp finish',
+          'batt finish', 'log', 'total')
+
+
+def _zigzag(n):
+    # Map signed ints to unsigned so small magnitudes make short varints
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+def _unzigzag(u):
+    return (u >> 1) if not (u & 1) else -((u + 1) >> 1)
+
+def _varint(n, out):
+    # Append unsigned int n to bytearray out as a LEB128 varint
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def _read_zigzags(buf, i, end, count):
+    # Read count zigzag varints from buf[i:end]. Returns (list, next index),
+    # or (None, end) if the data is truncated.
+    vals = []
+    while len(vals) < count:
+        (u, shift) = (0, 0)
+        while True:
+            if i >= end:
+                return (None, end)
+            b = buf[i]
+            i += 1
+            u |= (b & 0x7F) << shift
+            shift += 7
+            if not (b & 0x80):
+                break
+        vals.append(_unzigzag(u))
+    return (vals, i)
+
+
 class SleepMem:
     # Use ESP32-S3 4096 byte sleep memory as buffer for measurements.
 
@@ -12,14 +77,47 @@ class SleepMem:
     DATA = const(96)
     END = const(HEADER)           # length 2
     EPOCH = const(END + 2)        # length 8
+    FORMAT = const(EPOCH + 8)     # length 1
+    LAST = const(FORMAT + 1)      # length 8 (FMT_DELTA encoder state)
+    BATT = const(LAST + 8)        # length 4 (wake count, cached cV)
+    ROM = const(BATT + 4)         # length 32 (cached DS18B20 ROM addresses)
+    PROBES = const(ROM + 32)      # length 1 (temperatures per record)
+    LASTX = const(PROBES + 1)     # length 3 (FMT_DELTA state, probes 2..4)
+    SAMPLING = const(LASTX + 3)   # length 4 (interval s, max gap s)
+    SEEN = const(SAMPLING + 4)    # length 4 (timestamp of last sample)
+    TAIL = const(SEEN + 4)        # length 2 (ring buffer oldest record)
+    RING = const(TAIL + 2)        # length 1 (1 = overwrite oldest when full)
+    SPILL = const(RING + 1)       # length 1 (1 = next spill starts new file)
+    SUMMARY = const(SPILL + 1)    # length 24 (running stats, see summarize)
+    PROFILE = const(SUMMARY + 24) # length 1 (1 = profile area at the end)
+
+    # With profiling on, the end of sleep memory holds a wake count and then
+    # (last, min, max, sum) times per phase, in units of 0.1 ms
+    PROF_LEN = const(82)
+    PROF_FMT = const(10)       # bytes per phase, '<HHHI'
+
+    MAX_PROBES = const(4)      # DS18B20 probes per record (FMT_DELTA only)
 
     TIME_SHIFT = const(5)      # quantize times to 32 seconds
     TIME_MASK = const(0xFFFF)  # max time is ((2**16-1)<<5)/60/60/24 = 24 days
 
+    # Record format for new logs. FMT_DELTA fits about 3.6x more records.
+    DEFAULT_FORMAT = const(FMT_DELTA)
+
+    # FMT_DELTA block size. Each block starts with a keyframe, so a corrupted
+    # byte can only garble the rest of its own block.
+    BLOCK = const(64)
+    KEY_MASK = const(0xFFFFFF)  # keyframe time is 24 bits (17 years)
+
+    # Thresholds for the summary stats sample counters (°F)
+    FREEZE_F = const(32)
+    HOT_F = const(95)
+
     def __init__(self):
         # Set some non-terrible defaults on first boot or after a hard reset
         if self.end == 0:
             self.end = DATA
+            self.format = DEFAULT_FORMAT
         if self.epoch == 0:
             self.epoch = time.time()
 
@@ -45,6 +143,272 @@ class SleepMem:
         # Setter for epoch timestamp (32-bit unsigned int)
         sleep_memory[EPOCH:EPOCH+4] = pack('<I', val & 0xFFFFFFFF)
 
+    @property
+    def format(self):
+        # Getter for record format code (FMT_FIXED or FMT_DELTA)
+        return sleep_memory[FORMAT]
+
+    @format.setter
+    def format(self, val):
+        # Setter for record format code. Only change this on an empty log.
+        sleep_memory[FORMAT] = val
+
+    @property
+    def batt(self):
+        # Getter for (wake count, last measured battery cV) tuple. The wake
+        # count wraps at 16 bits. A cV of 0 means no cached measurement.
+        (wakes, v) = unpack('<HH', sleep_memory[BATT:BATT+4])
+        return (wakes, v & 0x1FF)
+
+    @batt.setter
+    def batt(self, val):
+        # Setter for (wake count, last measured battery cV[, age]) tuple,
+        # where age is how many wakes ago cV was measured (0 if just now).
+        # cV only needs 9 bits, so the age goes in the top 7 bits of its
+        # field, saturating at 127. Older firmware left those bits 0.
+        (wakes, cV) = val[:2]
+        age = min(val[2], 0x7F) if len(val) > 2 else 0
+        sleep_memory[BATT:BATT+4] = pack(
+            '<HH', wakes & 0xFFFF, (age << 9) | (cV & 0x1FF))
+
+    @property
+    def batt_age(self):
+        # Getter for how many wakes ago the cached cV was measured. Wakes in
+        # between logged the cached value.
+        return sleep_memory[BATT+3] >> 1
+
+    @property
+    def roms(self):
+        # Getter for list of cached DS18B20 ROM addresses (8 bytes each, all
+        # zeros for an empty slot), one slot per probe column
+        buf = sleep_memory[ROM:ROM+(MAX_PROBES*8)]
+        return [buf[i:i+8] for i in range(0, MAX_PROBES*8, 8)]
+
+    @roms.setter
+    def roms(self, val):
+        # Setter for list of cached ROM addresses (up to MAX_PROBES)
+        buf = bytearray(MAX_PROBES * 8)
+        for (i, rom) in enumerate(val[:MAX_PROBES]):
+            buf[i*8:i*8+8] = rom
+        sleep_memory[ROM:ROM+(MAX_PROBES*8)] = buf
+
+    @property
+    def probes(self):
+        # Getter for number of temperatures per record (0 from older
+        # firmware means 1)
+        return max(1, sleep_memory[PROBES])
+
+    @probes.setter
+    def probes(self, val):
+        # Setter for number of temperatures per record. Only change this on
+        # an empty log.
+        sleep_memory[PROBES] = max(1, min(val, MAX_PROBES))
+
+    @property
+    def sampling(self):
+        # Getter for (interval, max gap) tuple in seconds. A max gap of 0
+        # means every sample gets logged. An interval of 0 (older firmware)
+        # means the sample interval is unknown.
+        return unpack('<HH', sleep_memory[SAMPLING:SAMPLING+4])
+
+    @sampling.setter
+    def sampling(self, val):
+        # Setter for (interval, max gap) tuple. Only change this on an empty
+        # log, because FMT_DELTA records depend on the interval.
+        sleep_memory[SAMPLING:SAMPLING+4] = pack('<HH', *val)
+
+    @property
+    def seen(self):
+        # Getter for timestamp of the most recent sample, whether or not it
+        # was logged (0 if unknown)
+        return unpack('<I', sleep_memory[SEEN:SEEN+4])[0]
+
+    @seen.setter
+    def seen(self, val):
+        # Setter for timestamp of the most recent sample
+        sleep_memory[SEEN:SEEN+4] = pack('<I', val & 0xFFFFFFFF)
+
+    @property
+    def ring(self):
+        # Getter for ring buffer mode flag. In ring buffer mode, a full log
+        # overwrites its oldest records instead of dropping new ones.
+        return bool(sleep_memory[RING])
+
+    @ring.setter
+    def ring(self, val):
+        # Setter for ring buffer mode flag. Only change this on an empty log.
+        sleep_memory[RING] = 1 if val else 0
+
+    @property
+    def tail(self):
+        # Getter for index of the oldest record once a ring buffer log has
+        # wrapped around, or 0 if it hasn't (oldest record is at DATA)
+        return unpack('<H', sleep_memory[TAIL:TAIL+2])[0]
+
+    @tail.setter
+    def tail(self, val):
+        # Setter for index of the oldest record in a wrapped ring buffer
+        sleep_memory[TAIL:TAIL+2] = pack('<H', val)
+
+    @property
+    def spill_new(self):
+        # Getter for flag that makes the next spill() replace the spill file
+        # rather than append to it
+        return bool(sleep_memory[SPILL])
+
+    @spill_new.setter
+    def spill_new(self, val):
+        # Setter for new spill file flag. util.set_clock() sets this, since
+        # CIRCUITPY is read-only to code in admin mode.
+        sleep_memory[SPILL] = 1 if val else 0
+
+    @property
+    def empty(self):
+        # True if the log has no records
+        return (self.end == DATA) and not self.tail
+
+    def data_end(self):
+        # Return index of the end of the record area, which stops short of
+        # the profile area if there is one. FMT_FIXED only uses whole 4 byte
+        # slots.
+        size = len(sleep_memory)
+        if sleep_memory[PROFILE]:
+            size -= PROF_LEN
+        if self.format == FMT_FIXED:
+            return size - ((size - DATA) & 3)
+        return size
+
+    def segments(self):
+        # Return (start, end) index ranges that hold the records in
+        # chronological order. A wrapped ring buffer runs from the tail to
+        # the end of memory, then from DATA up to the end index.
+        (n, tail) = (self.end, self.tail)
+        if tail and tail >= n:
+            return ((tail, self.data_end()), (DATA, n))
+        return ((tail or DATA, n),)
+
+    @property
+    def summary(self):
+        # Getter for the running stats of the first probe since the log
+        # started: (samples, sum °F, min °F, min time, max °F, max time,
+        # lowest scaled cV, samples below FREEZE_F, samples above HOT_F,
+        # number of freezes, flags). Samples is 0 until the first sample.
+        return unpack(SUMMARY_FMT, sleep_memory[SUMMARY:SUMMARY+24])
+
+    def summarize(self, timestamp, tempF, cV):
+        # Add one sample to the summary stats in the header. This is O(1),
+        # so the stats are always current without scanning the records.
+        # Samples that change-driven logging skips get counted too.
+        tempF = ((tempF + 128) & 0xFF) - 128
+        if tempF == -128:
+            return  # probe failed
+        (n, total, lo, lo_t, hi, hi_t, lo_v, cold, hot, freezes,
+         flags) = self.summary
+        scv = self.scale_centivolts(cV) if 270 < cV < 430 else 0
+        if n == 0:
+            (lo, lo_t, hi, hi_t, lo_v) = (tempF, timestamp, tempF, timestamp,
+                                          0xFF)
+        n = min(n + 1, 0xFFFF)
+        total += tempF
+        if tempF < lo:
+            (lo, lo_t) = (tempF, timestamp)
+        if tempF > hi:
+            (hi, hi_t) = (tempF, timestamp)
+        if scv and (scv < lo_v):
+            lo_v = scv
+        if tempF < FREEZE_F:
+            cold = min(cold + 1, 0xFFFF)
+            if not (flags & 1):
+                freezes = min(freezes + 1, 0xFFFF)
+            flags |= 1
+        else:
+            flags &= ~1
+        if tempF > HOT_F:
+            hot = min(hot + 1, 0xFFFF)
+        sleep_memory[SUMMARY:SUMMARY+24] = pack(
+            SUMMARY_FMT, n, total, lo, lo_t, hi, hi_t, lo_v, cold, hot,
+            freezes, flags)
+
+    @property
+    def profiling(self):
+        # Getter for wake cycle profiling flag
+        return bool(sleep_memory[PROFILE])
+
+    @profiling.setter
+    def profiling(self, val):
+        # Setter for wake cycle profiling flag. Only change this on an empty
+        # log, because the profile area takes space from the records.
+        sleep_memory[PROFILE] = 1 if val else 0
+        if val:
+            n = len(sleep_memory)
+            sleep_memory[n-PROF_LEN:n] = bytes(PROF_LEN)
+
+    def add_profile(self, marks):
+        # Fold one wake cycle into the profile stats. marks is the list of
+        # monotonic_ns() times at the start of code.py and at the end of each
+        # phase in PHASES (except total). This is O(1) per wake.
+        base = len(sleep_memory) - PROF_LEN
+        buf = bytearray(sleep_memory[base:base+PROF_LEN])
+        count = unpack('<H', buf[0:2])[0]
+        full = count == 0xFFFF  # keep the mean, but still track min/max
+        if not full:
+            buf[0:2] = pack('<H', count + 1)
+        for i in range(len(PHASES)):
+            if i + 1 < len(marks):
+                d = marks[i+1] - marks[i]
+            else:
+                d = marks[-1] - marks[0]
+            d = min((d + 50000) // 100000, 0xFFFF)
+            j = 2 + i * PROF_FMT
+            (last, lo, hi, total) = unpack('<HHHI', buf[j:j+PROF_FMT])
+            if count == 0:
+                (lo, hi) = (d, d)
+            (lo, hi) = (min(lo, d), max(hi, d))
+            if not full:
+                total += d
+            buf[j:j+PROF_FMT] = pack('<HHHI', d, lo, hi, total)
+        sleep_memory[base:base+PROF_LEN] = buf
+
+    def profile_stats(self):
+        # Return (wake count, [(last, min, mean, max) ms per phase]), or None
+        # if profiling is off
+        if not self.profiling:
+            return None
+        base = len(sleep_memory) - PROF_LEN
+        buf = sleep_memory[base:base+PROF_LEN]
+        count = unpack('<H', buf[0:2])[0]
+        stats = []
+        for i in range(len(PHASES)):
+            j = 2 + i * PROF_FMT
+            (last, lo, hi, total) = unpack('<HHHI', buf[j:j+PROF_FMT])
+            mean = total / count if count else 0
+            stats.append((last / 10, lo / 10, mean / 10, hi / 10))
+        return (count, stats)
+
+    def last_logged(self):
+        # Return (timestamp, [tempF, ...], cV) for the most recent record
+        # without decoding the log, or None if the log is empty
+        n = self.end
+        if self.empty:
+            return None
+        if self.format == FMT_DELTA:
+            (ts_q, tempF, scv, _) = unpack('<IbBH', sleep_memory[LAST:LAST+8])
+            temps = [tempF]
+            temps += unpack('<3b', sleep_memory[LASTX:LASTX+3])[:self.probes-1]
+        else:
+            if n == DATA:
+                n = self.data_end()
+            data_u32 = unpack("<I", sleep_memory[n-4:n])[0]
+            ts_q = data_u32 >> 16
+            if self.ring:
+                # The 16-bit time may have rolled over, so use the full time
+                ts_q = unpack('<I', sleep_memory[LAST:LAST+4])[0]
+            tempF = (data_u32 >> 8) & 0xFF
+            temps = [tempF - 256 if tempF > 127 else tempF]
+            scv = data_u32 & 0xFF
+        timestamp = (ts_q << TIME_SHIFT) + self.epoch
+        return (timestamp, temps, self.unscale_centivolts(scv))
+
     def scale_centivolts(self, cV):
         # Scale a float battery voltage in centi-Volts to fit in uint8_t
         if not ((type(cV) == int) and (270 < cV < 430)):
@@ -57,26 +421,572 @@ class SleepMem:
         return u8_val + 270
 
     def append_data(self, timestamp, tempF, cV):
-        # Append measurements to buffer: 16-bit time, 8-bit temp, 8-bit cV
+        # Append measurements to buffer using the log's record format. The
+        # tempF argument may be one temperature, or a list with one per
+        # DS18B20 probe. The first append to an empty FMT_DELTA log sets the
+        # number of probes per record, and later lists get padded or
+        # truncated to match.
         n = self.end
+        fmt = self.format
+        temps = tempF if isinstance(tempF, (list, tuple)) else [tempF]
+        if (fmt == FMT_DELTA) and self.empty:
+            self.probes = len(temps)
+        count = self.probes if fmt == FMT_DELTA else 1
+        temps = list(temps[:count]) + [-128] * (count - len(temps))
         # Warn if temperature is out of range
-        if not (-128 <= tempF <= 127):
-            print("WARNING: TEMPERATURE OUT OF RANGE", tempF)
-        # Warn if timestamp is out of range
+        for t in temps:
+            if not (-128 <= t <= 127):
+                print("WARNING: TEMPERATURE OUT OF RANGE", t)
+        # Warn if timestamp is out of range. In a FMT_FIXED ring buffer the
+        # epoch follows the oldest record, so only the time since the last
+        # record has to fit.
+        limit = TIME_MASK if fmt == FMT_FIXED else KEY_MASK
+        base = self.epoch
+        if (fmt == FMT_FIXED) and self.ring and not self.empty:
+            base = self.last_logged()[0]
         if (
             (timestamp < self.epoch)
-            or ((timestamp - self.epoch) >> TIME_SHIFT) > 0xFFFF
+            or ((timestamp - base) >> TIME_SHIFT) > limit
             ):
             print("WARNING: TIMESTAMP OUT OF RANGE", timestamp)
+        scv = self.scale_centivolts(cV)
+        if fmt == FMT_DELTA:
+            ok = self.append_delta(n, timestamp, temps, scv)
+        else:
+            ok = self.append_fixed(n, timestamp, temps[0], scv)
+        if ok:
+            print("sleep_memory[%d] = %d F, %d cV" % (n, temps[0], cV))
+        else:
+            print("WARNING: BUFFER IS FULL")
+        self.summarize(timestamp, temps[0], cV)
+
+    def append_fixed(self, n, timestamp, tempF, scv):
         # Pack timestamp as 16 bits, temp as 8 bits, cV as 8 bits, and
         # save them in sleep_memory. To save space, this quantizes the
         # timestamps. Out of range values will be masked with & 0xFF...
-        scv = self.scale_centivolts(cV)
-        if n + 4 < len(sleep_memory):
+        if self.ring:
+            return self.append_fixed_ring(n, timestamp, tempF, scv)
+        if n + 4 < self.data_end():
             ts_u24 = ((timestamp - self.epoch) >> TIME_SHIFT) & TIME_MASK
             data_u32 = (ts_u24 << 16) | (tempF & 0xFF) << 8 | (scv & 0xFF)
             sleep_memory[n:n+4] = pack("<I", data_u32)
-            print("sleep_memory[%d] = %d F, %d cV" % (n, tempF, cV))
             self.end = n + 4
-        else:
-            print("WARNING: BUFFER IS FULL")
+            return True
+        return False
+
+    def append_fixed_ring(self, n, timestamp, tempF, scv):
+        # Ring buffer version of append_fixed(). Once the buffer has wrapped,
+        # the end index is also the oldest record, which gets overwritten.
+        # The 16-bit times only count 24 days from the epoch, so the epoch
+        # moves forward whenever the oldest record's time rolls over. That
+        # keeps the epoch within 24 days of the oldest record for O(1) cost.
+        # The LAST header field keeps the full time of the newest record.
+        data_end = self.data_end()
+        if self.tail:
+            nxt = n + 4 if n + 4 < data_end else DATA
+            (old_q, new_q) = unpack('<HH', sleep_memory[n+2:n+4]
+                                    + sleep_memory[nxt+2:nxt+4])
+            if new_q < old_q:
+                self.epoch += 1 << (16 + TIME_SHIFT)
+        ts_q = (timestamp - self.epoch) >> TIME_SHIFT
+        data_u32 = ((ts_q & TIME_MASK) << 16) | (tempF & 0xFF) << 8
+        data_u32 |= scv & 0xFF
+        sleep_memory[n:n+4] = pack("<I", data_u32)
+        sleep_memory[LAST:LAST+4] = pack('<I', ts_q & 0xFFFFFFFF)
+        n += 4
+        if n >= data_end:
+            n = DATA
+            self.tail = DATA
+        if self.tail:
+            self.tail = n
+        self.end = n
+        return True
+
+    def append_delta(self, n, timestamp, temps, scv):
+        # Encode a record relative to the previous one, whose values are kept
+        # in the LAST and LASTX header fields, so this costs the same on
+        # every wake no matter how full the buffer is.
+        #
+        # Time is stored as the change in sample interval (usually -1, 0, or
+        # +1 units of 32 seconds), so the logging interval is implicit. Temp
+        # and scaled cV are stored as deltas. A compact delta packs all three
+        # into one byte: 0b0TTFFFVV with TT = dt+2, FFF = dF+4, VV = dV+2.
+        # Anything bigger uses a WIDE tag and three zigzag varints. With more
+        # than one probe, each record is followed by one zigzag varint delta
+        # per extra probe (or one int8 per extra probe after a keyframe).
+        #
+        # When the SAMPLING header knows the interval, the predicted time
+        # step comes from the interval rather than the previous step, and a
+        # 1 byte skip tag before the record counts the samples skipped by
+        # change-driven logging. That keeps records after a gap compact.
+        #
+        # In ring buffer mode, a full log wraps around to DATA and each new
+        # block overwrites the oldest one. Keyframe times are 24 bits, so
+        # the epoch can stay put.
+        ts_q = ((timestamp - self.epoch) >> TIME_SHIFT) & KEY_MASK
+        temps = [((t + 128) & 0xFF) - 128 for t in temps]  # wrap like FIXED
+        (tempF, extra) = (temps[0], temps[1:])
+        size = self.data_end()
+        block_end = min(n - (n - DATA) % BLOCK + BLOCK, size)
+        (dt, rec) = (0, None)
+        if not self.empty:
+            (last_ts, last_f, last_v, last_dt) = unpack(
+                '<IbBH', sleep_memory[LAST:LAST+8])
+            dt = ts_q - last_ts
+            (skip, pred) = (0, last_dt)
+            interval = self.sampling[0]
+            if interval:
+                # Count whole intervals since the last record
+                m = max(1, ((dt << TIME_SHIFT) + (interval >> 1)) // interval)
+                skip = m - 1
+                pred = (m * interval + 16) >> TIME_SHIFT
+            if (
+                (n - DATA) % BLOCK and (0 <= dt) and (skip <= MAX_SKIP)
+                and (interval or dt <= 0xFF)
+                ):
+                (e, df, dv) = (dt - pred, tempF - last_f, scv - last_v)
+                rec = bytearray([skip]) if skip else bytearray()
+                if (-1 <= e <= 1) and (-4 <= df <= 3) and (-2 <= dv <= 1):
+                    rec.append((e + 2) << 5 | (df + 4) << 2 | (dv + 2))
+                else:
+                    rec.append(WIDE)
+                    _varint(_zigzag(e), rec)
+                    _varint(_zigzag(df), rec)
+                    _varint(_zigzag(dv), rec)
+                if extra:
+                    last_x = unpack('<3b', sleep_memory[LASTX:LASTX+3])
+                    for (t, last_t) in zip(extra, last_x):
+                        _varint(_zigzag(t - last_t), rec)
+        # Keyframes start each block, and also follow clock jumps
+        dt = max(0, min(dt, 0xFF))
+        if rec is None:
+            rec = self.keyframe(ts_q, temps, scv, dt)
+        if n + len(rec) > block_end:
+            # Doesn't fit, so pad out this block and start the next one
+            rec = self.keyframe(ts_q, temps, scv, dt)
+            nxt = block_end
+            if block_end + len(rec) > size:
+                if not self.ring:
+                    return False
+                nxt = DATA
+            sleep_memory[n:block_end] = bytes(block_end - n)
+            if nxt == DATA:
+                self.tail = DATA
+            n = nxt
+        if self.tail and not (n - DATA) % BLOCK:
+            # Starting a block in a wrapped ring, so the next block is the
+            # oldest one left
+            self.tail = n + BLOCK if n + BLOCK < size else DATA
+        sleep_memory[n:n+len(rec)] = rec
+        sleep_memory[LAST:LAST+8] = pack('<IbBH', ts_q, tempF, scv, dt)
+        if extra:
+            sleep_memory[LASTX:LASTX+3] = pack('<3b', *(extra + [0, 0])[:3])
+        self.end = n + len(rec)
+        return True
+
+    def keyframe(self, ts_q, temps, scv, dt):
+        # Pack a FMT_DELTA keyframe: absolute 24-bit time, temp, scaled cV,
+        # the last sample interval (predicts the next one), then one int8
+        # per extra probe
+        fmt = '<BHBbBB' + ('%db' % (len(temps) - 1) if len(temps) > 1 else '')
+        return pack(fmt, KEY, ts_q & 0xFFFF, ts_q >> 16, temps[0], scv, dt,
+                    *temps[1:])
+
+    def records(self, start=None, end=None):
+        # Generate (timestamp, tempF, cV) tuples for all records in the log,
+        # or only the ones from the start timestamp to the end timestamp
+        # (inclusive). This copies the record area out of sleep memory once
+        # and decodes the copy, rather than slicing sleep_memory for each
+        # record. Times only go forward, so the first record at or after
+        # start gets found by binary search, and decoding stops after end.
+        if self.format == FMT_DELTA:
+            yield from self.delta_records(start, end)
+            return
+        first = 0 if start is None else start
+        last = 0xFFFFFFFF if end is None else end
+        epoch = self.epoch
+        unscale = self.unscale_centivolts
+        ring = self.ring
+        last_q = 0
+        for (i, j) in self.segments():
+            if (start is not None) and not ring:
+                # A ring buffer's 16-bit times roll over, so only bisect the
+                # plain log
+                i = self.bisect_fixed(i, j, (start - epoch) >> TIME_SHIFT)
+            n = (j - i) >> 2
+            # Batch unpack the u32 records: 16-bit time, i8 temp, u8 cV
+            for data_u32 in unpack('<%dI' % n, sleep_memory[i:j]):
+                tempF = (data_u32 >> 8) & 0xFF
+                if tempF > 127:
+                    tempF -= 256
+                if ring:
+                    # Times count from the oldest record, so a smaller time
+                    # means the 16-bit field rolled over
+                    if (data_u32 >> 16) < last_q:
+                        epoch += 1 << (16 + TIME_SHIFT)
+                    last_q = data_u32 >> 16
+                timestamp = ((data_u32 >> 16) << TIME_SHIFT) + epoch
+                if timestamp > last:
+                    return
+                if timestamp >= first:
+                    yield (timestamp, tempF, unscale(data_u32 & 0xFF))
+
+    def bisect_fixed(self, i, j, ts_q):
+        # Return index of the first FMT_FIXED record in sleep_memory[i:j]
+        # with a 16-bit time of at least ts_q
+        (lo, hi) = (i >> 2, j >> 2)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            k = (mid << 2) + 2
+            if unpack('<H', sleep_memory[k:k+2])[0] < ts_q:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo << 2
+
+    def delta_records(self, start=None, end=None):
+        # Decode FMT_DELTA blocks. A reserved tag or truncated record means
+        # the block is corrupt, so skip to the keyframe of the next block.
+        (epoch, probes, interval) = (self.epoch, self.probes, self.sampling[0])
+        for (i, j) in self.segments():
+            yield from self.decode_blocks(
+                sleep_memory[i:j], epoch, probes, interval, start, end)
+
+    def bisect_blocks(self, buf, ts_q):
+        # Return the offset of the block in buf to start decoding from to
+        # find the first record with a time of at least ts_q. That's the
+        # block before the first keyframe at or after ts_q. Blocks with a
+        # corrupt keyframe count as late, so the search errs on the early
+        # side.
+        (lo, hi) = (0, (len(buf) + BLOCK - 1) // BLOCK)
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            k = mid * BLOCK
+            if (buf[k] == KEY) and (k + 4 <= len(buf)) and (
+                    (buf[k+1] | buf[k+2] << 8 | buf[k+3] << 16) < ts_q):
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(0, lo - 1) * BLOCK
+
+    def decode_blocks(self, buf, epoch, probes, interval, start=None,
+                      end=None, keys=None):
+        # Decode a run of whole FMT_DELTA blocks copied out of sleep memory
+        # (or read from the spill file), optionally only from the start
+        # timestamp to the end timestamp. If keys is a list, the offset of
+        # each keyframe gets appended to it.
+        unscale = self.unscale_centivolts
+        nx = probes - 1
+        key_len = 7 + nx
+        key_fmt = '<HBbBB' + ('%db' % nx if nx else '')
+        (first, last, blk0) = (0, 0xFFFFFFFF, 0)
+        if start is not None:
+            first = start
+            blk0 = self.bisect_blocks(buf, (start - epoch) >> TIME_SHIFT)
+        if end is not None:
+            last = end
+        end = len(buf)
+        for blk in range(blk0, end, BLOCK):
+            i = blk
+            blk_end = min(blk + BLOCK, end)
+            ts_q = None
+            while i < blk_end:
+                tag = buf[i]
+                if tag == KEY and i + key_len <= blk_end:
+                    (lo, hi, f, v, dt, *x) = unpack(
+                        key_fmt, buf[i+1:i+key_len])
+                    if keys is not None:
+                        keys.append(i)
+                    ts_q = hi << 16 | lo
+                    i += key_len
+                else:
+                    if ts_q is None:
+                        break
+                    skip = 0
+                    if 0 < tag <= MAX_SKIP:
+                        skip = tag
+                        i += 1
+                        if i >= blk_end:
+                            break
+                        tag = buf[i]
+                    if interval:
+                        dt = ((skip + 1) * interval + 16) >> TIME_SHIFT
+                    if 0x20 <= tag < 0x80:
+                        dt += (tag >> 5) - 2
+                        f += ((tag >> 2) & 7) - 4
+                        v += (tag & 3) - 2
+                        i += 1
+                    elif tag == WIDE:
+                        (d, i) = _read_zigzags(buf, i + 1, blk_end, 3)
+                        if d is None:
+                            break
+                        dt += d[0]
+                        f += d[1]
+                        v += d[2]
+                    else:
+                        break
+                    ts_q += dt
+                    if nx:
+                        (d, i) = _read_zigzags(buf, i, blk_end, nx)
+                        if d is None:
+                            break
+                        x = [a + b for (a, b) in zip(x, d)]
+                timestamp = (ts_q << TIME_SHIFT) + epoch
+                if timestamp > last:
+                    return
+                if timestamp >= first:
+                    yield (timestamp, f, unscale(v)) + tuple(x)
+
+    def adjust_clock(self, delta, now, drift=True, path=SPILL_FILE):
+        # Rebase the log for an RTC correction of delta seconds made at time
+        # now (on the old clock), so records keep decoding to correct times.
+        # Returns False, after printing why, if the log can't be rebased.
+        #
+        # With drift=True, the RTC error is taken to have grown steadily
+        # since set_clock() started the log, so each record moves by its
+        # share of delta, and the newest by nearly all of it. Records spilled
+        # to flash can't be rewritten (CIRCUITPY is read-only in admin mode),
+        # so then the correction ramps up from the oldest record in sleep
+        # memory instead. FMT_DELTA records move with their block's keyframe,
+        # so a big enough negative correction over a short span would put
+        # records out of order. That gets refused rather than breaking range
+        # queries and dump().
+        #
+        # With drift=False, every record moves by delta (for a clock that
+        # was set wrong), which only takes a new epoch. Spilled records would
+        # keep their old times, so that needs a log with none spilled.
+        spilled = next(self.spilled_records(path), None) is not None
+        if not drift:
+            if spilled:
+                print("ERROR: can't shift the records spilled to", path)
+                return False
+            self.epoch += delta
+            self.rebase_summary(lambda t: delta)
+            return True
+        if self.empty:
+            return True
+        fmt = self.format
+        if (fmt == FMT_FIXED) and self.ring:
+            print("ERROR: can't spread a correction over a FMT_FIXED ring")
+            return False
+        epoch = self.epoch
+        t0 = next(self.records())[0] if spilled else epoch
+        span = max(1, now - t0)
+
+        def corr(t):
+            # Correction (seconds) for a record at time t
+            return delta * max(0, min(t - t0, span)) // span
+
+        def corr_q(ts_q):
+            # Correction for a record time in units of 32 seconds
+            return (corr((ts_q << TIME_SHIFT) + epoch) + 16) >> TIME_SHIFT
+
+        # Rebase copies of the records first, so nothing changes unless they
+        # still decode in time order, ending before the next record (which
+        # gets the corrected time)
+        (writes, shift, prev, ordered) = ([], 0, 0, True)
+        (probes, interval) = (self.probes, self.sampling[0])
+        for (i, j) in self.segments():
+            buf = bytearray(sleep_memory[i:j])
+            if fmt == FMT_DELTA:
+                keys = []
+                for _ in self.decode_blocks(buf, epoch, probes, interval,
+                                            keys=keys):
+                    pass
+                # Records between keyframes are relative, so they move with
+                # their keyframe
+                for k in keys:
+                    ts_q = buf[k+1] | buf[k+2] << 8 | buf[k+3] << 16
+                    shift = corr_q(ts_q)
+                    ts_q = max(0, min(ts_q + shift, KEY_MASK))
+                    buf[k+1:k+4] = pack('<HB', ts_q & 0xFFFF, ts_q >> 16)
+                times = [r[0] for r in self.decode_blocks(
+                    buf, epoch, probes, interval)]
+            else:
+                times = []
+                for k in range(0, len(buf), 4):
+                    ts_q = buf[k+2] | buf[k+3] << 8
+                    ts_q = max(0, min(ts_q + corr_q(ts_q), TIME_MASK))
+                    buf[k+2:k+4] = pack('<H', ts_q)
+                    times.append((ts_q << TIME_SHIFT) + epoch)
+            for t in times:
+                ordered = ordered and (t >= prev)
+                prev = t
+            writes.append((i, j, buf))
+        if not (ordered and (prev <= now + delta)):
+            print("ERROR: %+d s is too much to spread over %.1f hours of"
+                  " records without putting them out of order"
+                  % (delta, span / 3600))
+            return False
+        for (i, j, buf) in writes:
+            sleep_memory[i:j] = buf
+        if fmt == FMT_DELTA:
+            # The next record is relative to the last one as it now decodes
+            last_q = unpack('<I', sleep_memory[LAST:LAST+4])[0]
+            sleep_memory[LAST:LAST+4] = pack('<I', max(0, last_q + shift))
+        self.rebase_summary(corr)
+        return True
+
+    def rebase_summary(self, corr):
+        # Move the SEEN time and the summary min and max times by corr(t)
+        if self.seen:
+            self.seen += corr(self.seen)
+        (n, total, lo, lo_t, hi, hi_t, lo_v, cold, hot, freezes,
+         flags) = self.summary
+        if n:
+            sleep_memory[SUMMARY:SUMMARY+24] = pack(
+                SUMMARY_FMT, n, total, lo, lo_t + corr(lo_t), hi,
+                hi_t + corr(hi_t), lo_v, cold, hot, freezes, flags)
+
+    def spill(self, path, min_blocks):
+        # Move the full FMT_DELTA blocks at the start of the log to the end of
+        # the spill file once there are at least min_blocks of them, keeping
+        # only the block with the newest record in sleep memory. Batching the
+        # blocks means flash gets written rarely, in large whole-block
+        # chunks. Returns the number of bytes written to the file.
+        n = self.end
+        if (self.format != FMT_DELTA) or self.tail or (n <= DATA):
+            return 0
+        head = n - 1 - (n - 1 - DATA) % BLOCK
+        count = (head - DATA) // BLOCK
+        if (count == 0) or (count < min_blocks):
+            return 0
+        blocks = sleep_memory[DATA:head]
+        (interval, max_gap) = self.sampling
+        seg = pack(SPILL_FMT, SPILL_MAGIC, self.epoch, FMT_DELTA, self.probes,
+                   interval, max_gap, count, crc32(blocks))
+        try:
+            with open(path, 'wb' if self.spill_new else 'ab') as f:
+                f.write(seg + bytes(BLOCK - len(seg)))
+                f.write(blocks)
+        except OSError as e:
+            # Read-only (USB has CIRCUITPY) or full, so keep it all in RAM
+            print("WARNING: SPILL FAILED", e)
+            return 0
+        self.spill_new = False
+        sleep_memory[DATA:DATA+(n-head)] = sleep_memory[head:n]
+        self.end = DATA + (n - head)
+        return BLOCK + len(blocks)
+
+    def open_spill(self, path):
+        # Open the spill file for reading, or return None if there isn't one.
+        # After util.set_clock(), the file holds the previous log until the
+        # next spill replaces it, so it doesn't count as part of this log.
+        if self.spill_new:
+            return None
+        try:
+            return open(path, 'rb')
+        except OSError:
+            return None
+
+    def spill_segments(self, f):
+        # Return a list of (offset, epoch, probes, interval, count, crc, t)
+        # for the segments in the open spill file f, where t is the time of
+        # the segment's first record (None if it doesn't start with a
+        # keyframe). Only the headers and first keyframes get read, so this
+        # stays quick however big the file gets. A header that's damaged, or
+        # whose block count doesn't lead to the next header or the end of the
+        # file, gets skipped by scanning ahead one block at a time.
+        size = f.seek(0, 2)
+        (segs, pos) = ([], 0)
+        while pos + BLOCK <= size:
+            f.seek(pos)
+            seg = f.read(BLOCK + 4)
+            (magic, epoch, fmt, probes, interval, _, count, crc) = unpack(
+                SPILL_FMT, seg[:20])
+            nxt = pos + (count + 1) * BLOCK
+            ok = (magic == SPILL_MAGIC) and (fmt == FMT_DELTA) and (
+                nxt <= size)
+            if ok and (nxt < size):
+                f.seek(nxt)
+                ok = f.read(4) == SPILL_MAGIC
+            if not ok:
+                pos += BLOCK
+                continue
+            t = None
+            if count and (seg[BLOCK] == KEY):
+                t = ((seg[BLOCK+1] | seg[BLOCK+2] << 8 | seg[BLOCK+3] << 16)
+                     << TIME_SHIFT) + epoch
+            segs.append((pos, epoch, probes, interval, count, crc, t))
+            pos = nxt
+        return segs
+
+    def spill_blocks(self, f, seg):
+        # Read the blocks of a segment listed by spill_segments(), or return
+        # None if they fail the CRC check
+        f.seek(seg[0] + BLOCK)
+        blocks = f.read(seg[4] * BLOCK)
+        if (len(blocks) < seg[4] * BLOCK) or (crc32(blocks) != seg[5]):
+            return None
+        return blocks
+
+    def spilled_records(self, path, start=None, end=None):
+        # Generate (timestamp, tempF, cV, ...) tuples from the spill file,
+        # optionally only from the start timestamp to the end timestamp.
+        # Every record in a segment comes no later than the first record of
+        # the next one, so segments that end before start get skipped
+        # without reading their blocks. A segment that fails its CRC check
+        # gets skipped too.
+        f = self.open_spill(path)
+        if f is None:
+            return
+        with f:
+            segs = self.spill_segments(f)
+            for (k, seg) in enumerate(segs):
+                (epoch, probes, interval) = seg[1:4]
+                # Segments after the end time mean the rest are too
+                if (end is not None) and (seg[6] is not None) and (
+                        seg[6] > end):
+                    return
+                if (start is not None) and (k + 1 < len(segs)) and (
+                        segs[k+1][6] is not None) and (segs[k+1][6] < start):
+                    continue
+                blocks = self.spill_blocks(f, seg)
+                if blocks is not None:
+                    yield from self.decode_blocks(
+                        blocks, epoch, probes, interval, start, end)
+
+    def all_records(self, path=SPILL_FILE, start=None, end=None):
+        # Generate the records from the spill file, then from sleep memory,
+        # optionally only from the start timestamp to the end timestamp
+        yield from self.spilled_records(path, start, end)
+        yield from self.records(start, end)
+
+    def last_records(self, n, path=SPILL_FILE):
+        # Return a list of the newest n records. For FMT_DELTA, this decodes
+        # backward from the end of the log, doubling the number of blocks
+        # each try, so the work is proportional to n rather than the size of
+        # the log. FMT_FIXED logs are short, so they just get decoded.
+        if n <= 0:
+            return []
+        if self.format != FMT_DELTA:
+            return list(self.records())[-n:]
+        (epoch, probes, interval) = (self.epoch, self.probes, self.sampling[0])
+        recs = []
+        for (i, j) in reversed(self.segments()):
+            buf = sleep_memory[i:j]
+            count = (len(buf) + BLOCK - 1) // BLOCK
+            k = 1
+            while True:
+                b = max(0, count - k)
+                got = list(self.decode_blocks(
+                    buf[b*BLOCK:], epoch, probes, interval))
+                if (b == 0) or (len(got) + len(recs) >= n):
+                    break
+                k <<= 1
+            recs = got + recs
+            if len(recs) >= n:
+                return recs[-n:]
+        # Not enough in sleep memory, so take the rest from the spill file,
+        # decoding its segments newest first until there are enough
+        f = self.open_spill(path)
+        if f is None:
+            return recs
+        with f:
+            for seg in reversed(self.spill_segments(f)):
+                blocks = self.spill_blocks(f, seg)
+                if blocks is not None:
+                    recs = list(self.decode_blocks(blocks, *seg[1:4])) + recs
+                    if len(recs) >= n:
+                        break
+        return recs[-n:]
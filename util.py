@@ -3,19 +3,21 @@
 # These are utility functions for configuring the datalogger and exporting
 # logged data. This is meant to be used manually from the serial REPL.
 from alarm import sleep_memory
+from binascii import b2a_base64, crc32, hexlify
 import board
 from board import board_id, I2C
 from rtc import RTC
-from struct import unpack
 import time
 from time import mktime, sleep, struct_time
 
 from adafruit_datetime import datetime
 from adafruit_max1704x import MAX17048
 
-from datalogger import battery_centivolts
+from datalogger import (
+    a3_centivolts, battery_centivolts, has_A3_divider, set_a3_calibration
+)
 from redled import RedLED
-from sleepmem import SleepMem
+from sleepmem import PHASES, SleepMem
 
 
 def batt():
@@ -26,19 +28,234 @@ def batt():
     else:
         print('Voltage measurement not available')
 
-def dump():
-    # Print the data log in CSV format to serial console
+def calibrate_batt(volts):
+    # Calibrate the battery reading of a QT Py with the A3 divider against a
+    # multimeter reading of the battery (Volts) taken at the same time, like:
+    #   calibrate_batt(3.92)
+    # The factor gets saved in this board's nvm, so it survives code updates
+    # and set_clock().
+    if not has_A3_divider():
+        print('Only boards with the A3 battery divider need calibrating')
+        return
+    raw = a3_centivolts(cal=1.0)
+    cal = (volts * 100 / raw) if raw else 0
+    if not (0.8 <= cal <= 1.2):
+        print('ERROR: A3 reads %d cV, too far from %.2f V. Check the divider.'
+              % (raw, volts))
+        return
+    set_a3_calibration(cal)
+    print('calibration factor: %.4f (now reads %d cV)' % (
+        cal, a3_centivolts()))
+
+def summary():
+    # Print the running stats (first probe) since the log started. These come
+    # from the sleep memory header, so this is instant even with a full log.
+    sm = SleepMem()
+    (n, total, lo, lo_t, hi, hi_t, lo_v, cold, hot, freezes, _) = sm.summary
+    if not n:
+        print('No samples yet')
+        return
+    interval = sm.sampling[0]
+    print('Samples: %d' % n)
+    print('Mean: %.1f °F' % (total / n))
+    print('Min: %d °F at %s' % (lo, when(lo_t)))
+    print('Max: %d °F at %s' % (hi, when(hi_t)))
+    hours = ''
+    if interval:
+        hours = ' (%.1f hours)' % (cold * interval / 3600)
+    print('Below %d °F: %d samples%s, %d freezes' % (
+        sm.FREEZE_F, cold, hours, freezes))
+    if interval:
+        hours = ' (%.1f hours)' % (hot * interval / 3600)
+    print('Above %d °F: %d samples%s' % (sm.HOT_F, hot, hours))
+    if lo_v != 0xFF:
+        print('Lowest battery: %d cV' % sm.unscale_centivolts(lo_v))
+    (_, cV) = sm.batt
+    if cV:
+        # Samples in between measurements logged this cached value
+        age = sm.batt_age
+        if age:
+            print('Last battery: %d cV (cached, measured %d%s wakes earlier)'
+                  % (cV, age, '+' if age == 0x7F else ''))
+        else:
+            print('Last battery: %d cV (measured)' % cV)
+
+def profile():
+    # Print the wake cycle timing stats that code.py keeps when PROFILE is on
+    stats = SleepMem().profile_stats()
+    if stats is None:
+        print('Profiling is off. Set PROFILE = const(1) in code.py, then start')
+        print('a new log with set_clock().')
+        return
+    (count, phases) = stats
+    print('Wakes: %d' % count)
+    print('%-12s %8s %8s %8s %8s' % ('phase (ms)', 'last', 'min', 'mean',
+                                     'max'))
+    for (name, (last, lo, mean, hi)) in zip(PHASES, phases):
+        print('%-12s %8.1f %8.1f %8.1f %8.1f' % (name, last, lo, mean, hi))
+
+def when(timestamp):
+    # Format a timestamp like dump() does
+    for row in rows([(timestamp,)]):
+        return '%d/%d %02d:%02d' % row
+
+def dump(chunk=32, fill=True, start=None, end=None):
+    # Print the data log in CSV format to serial console. Lines get printed
+    # in batches of `chunk` lines, which is much faster than one print() per
+    # record over USB serial (chunk=1 prints one record at a time). With
+    # change-driven logging, fill=True prints a row for every sample
+    # interval, repeating the held values, and fill=False prints only the
+    # records that were actually logged. Records that were spilled to flash
+    # come first, followed by the ones still in sleep memory.
+    #
+    # To print part of the log, pass start and/or end times as timestamps
+    # or (year, month, day, hour, minute) tuples, like:
+    #   dump(start=(2025, 3, 1, 22, 0), end=(2025, 3, 2, 6, 0))
+    # That only decodes the part of the log in the time range.
+    (start, end) = (to_timestamp(start), to_timestamp(end))
+    sm = SleepMem()
+    if sm.tail:
+        print("# NVRAM ring buffer wrapped, oldest at index %d" % sm.tail)
+    else:
+        percent = 100 * (sm.end - sm.DATA) / (sm.data_end() - sm.DATA)
+        print("# NVRAM end index: %d (%.0f%% of buffer)" % (sm.end, percent))
+    (interval, max_gap) = sm.sampling
+    if fill and interval and max_gap:
+        # Start early enough to get the record held at the start time
+        first = None if start is None else start - max_gap
+        records = filled(sm.all_records(start=first, end=end), interval,
+                         max_gap, sm.seen)
+        if (start is not None) or (end is not None):
+            records = between(records, start, end)
+    else:
+        records = sm.all_records(start=start, end=end)
+    print_csv(sm.probes, records, chunk)
+
+def tail(n=10, fill=True):
+    # Print the newest n rows of the data log in CSV format. This only
+    # decodes the end of the log, so it's quick even when the log is full.
+    sm = SleepMem()
+    records = sm.last_records(n)
+    if fill:
+        (interval, max_gap) = sm.sampling
+        records = list(filled(records, interval, max_gap, sm.seen))[-n:]
+    print_csv(sm.probes, records, n)
+
+def print_csv(probes, records, chunk):
+    # Print a CSV header and rows for records, in batches of chunk lines
+    (header, line) = csv_format(probes)
+    print(header)
+    lines = []
+    for row in rows(records):
+        lines.append(line % row)
+        if len(lines) >= chunk:
+            print('\n'.join(lines))
+            lines = []
+    if lines:
+        print('\n'.join(lines))
+
+def to_timestamp(t):
+    # Convert a (year, month, day, hour, minute[, second]) tuple to a
+    # timestamp. Timestamps and None pass through.
+    if isinstance(t, (tuple, list)):
+        t = tuple(t) + (0,) * (6 - len(t))
+        return mktime(struct_time(t[:6] + (0, -1, -1)))
+    return t
+
+def between(records, start, end):
+    # Generate the records from the start timestamp to the end timestamp
+    # (either may be None for no limit)
+    for rec in records:
+        if (end is not None) and (rec[0] > end):
+            return
+        if (start is None) or (rec[0] >= start):
+            yield rec
+
+def dump_binary(chunks=None, size=240, encoding='base64'):
+    # Print raw sleep memory (header and records, up to the end index) as
+    # checksummed text chunks for host/logdecode.py. This is several times
+    # smaller than the CSV from dump(). Output looks like:
+    #
+    #   #BIN <board_id> <end> <size> <count> <encoding>
+    #   <seq> <crc32> <payload>      (one line per chunk)
+    #   #END <crc32 of whole image>
+    #
+    # If the host finds bad or missing chunks, it tells you which ones to
+    # resend, like: dump_binary(chunks=[3, 7])
+    if not (encoding in ('base64', 'hex')):
+        print("ERROR Bad encoding:", encoding)
+        return
     sm = SleepMem()
-    percent = 100 * (sm.end - sm.DATA) / (len(sleep_memory) - sm.DATA)
-    print("# NVRAM end index: %d (%.0f%% of buffer)" % (sm.end, percent))
-    print("Date Time,°F,centi-Volts")
-    for i in range(sm.DATA, sm.end, 4):
-        data_u32 = unpack("<I", sleep_memory[i:i+4])[0]   # unsigned u32
-        timestamp = (data_u32 >> (16 - sm.TIME_SHIFT)) + sm.epoch
-        (mon,d,h,min_,s) = datetime.fromtimestamp(timestamp).timetuple()[1:6]
-        tempF = unpack("<b", sleep_memory[i+1:i+2])[0]    # signed i8
-        cV = sm.unscale_centivolts(sleep_memory[i])         # u8 (scaled cV)
-        print('%d/%d %02d:%02d,%d,%d' % (mon, d, h, min_, tempF, cV))
+    # A wrapped ring buffer has records all the way to the end of memory
+    end = len(sleep_memory) if sm.tail else sm.end
+    count = (end + size - 1) // size
+    print('#BIN %s %d %d %d %s' % (board_id, end, size, count, encoding))
+    for seq in (range(count) if chunks is None else chunks):
+        if not (0 <= seq < count):
+            print("ERROR Bad chunk:", seq)
+            continue
+        data = sleep_memory[seq*size:min(end, (seq+1)*size)]
+        if encoding == 'hex':
+            payload = hexlify(data)
+        else:
+            payload = b2a_base64(data).strip()
+        print('%d %08x %s' % (seq, crc32(data), payload.decode()))
+    print('#END %08x' % crc32(sleep_memory[0:end]))
+
+def csv_format(probes):
+    # Return (header, line format) for CSV with one °F column per probe.
+    # Extra probe columns go after the original three, so tools expecting
+    # the single probe layout keep working.
+    header = "Date Time,°F,centi-Volts"
+    header += ''.join([',°F %d' % i for i in range(2, probes + 1)])
+    return (header, '%d/%d %02d:%02d,%d,%d' + ',%d' * (probes - 1))
+
+def filled(records, interval, max_gap, seen=0):
+    # Re-insert the samples that change-driven logging skipped. Each record
+    # holds until the next one, so a gap of up to max_gap gets one copy of
+    # the held record per sample interval. Longer gaps mean the logger
+    # wasn't sampling (admin mode, dead battery), so they stay gaps. The
+    # seen timestamp extends the last record up to the most recent sample.
+    if not (interval and max_gap):
+        yield from records
+        return
+    limit = max_gap + (interval >> 1)
+    prev = None
+    for rec in records:
+        if prev is not None:
+            yield from held(prev, rec[0], interval, limit)
+        yield rec
+        prev = rec
+    if prev is not None and seen > prev[0]:
+        yield from held(prev, seen + interval, interval, limit)
+
+def held(rec, until, interval, limit):
+    # Generate copies of rec every interval seconds, stopping half an
+    # interval short of the until timestamp
+    t0 = rec[0]
+    if until - t0 > limit:
+        return
+    t = t0 + interval
+    while t < until - (interval >> 1):
+        yield (t,) + rec[1:]
+        t += interval
+
+def rows(records):
+    # Convert (timestamp, tempF, cV, ...) records to (month, day, hour,
+    # minute, tempF, cV, ...) tuples. Calendar math is slow, so this only
+    # converts a full date once per day, then advances the time of day
+    # incrementally.
+    day_start = day_end = 0
+    mon = d = 0
+    for rec in records:
+        timestamp = rec[0]
+        if not (day_start <= timestamp < day_end):
+            (mon, d, h, min_, s) = (
+                datetime.fromtimestamp(timestamp).timetuple()[1:6])
+            day_start = timestamp - (h * 3600 + min_ * 60 + s)
+            day_end = day_start + 86400
+        sod = timestamp - day_start
+        yield (mon, d, sod // 3600, (sod // 60) % 60) + rec[1:]
 
 def set_clock():
     # Clear memory, set real time clock (RTC) time, set epoch
@@ -46,12 +263,46 @@ def set_clock():
     if not (ans in ["y", "Y"]):
         print("RESET CANCELED")
         return
-    # Clear sleep memory
-    for i in range(len(sleep_memory)):
-        sleep_memory[i] = 0
+    # Clear sleep memory with one slice assignment
+    sleep_memory[0:len(sleep_memory)] = bytes(len(sleep_memory))
     print("SLEEP MEMORY CLEARED")
+    # CIRCUITPY is read-only to code in admin mode, so flag the spill file
+    # for replacement when the next log spills
+    SleepMem().spill_new = True
     # Set clock
-    rtc = RTC()
+    t = ask_time()
+    if t:
+        RTC().datetime = t
+        print("new RTC time: ", now())
+    # Set epoch
+    sm = SleepMem()
+    sm.epoch = time.time()
+    print("new epoch is: ", sm.epoch)
+
+def adjust_clock(drift=True):
+    # Set the real time clock (RTC) without losing the log. The records get
+    # rebased so that dump() gives correct times on both sides of the
+    # adjustment. By default, the correction gets spread over the log,
+    # assuming the RTC drifted steadily since set_clock(). Use
+    # adjust_clock(drift=False) when the clock was set wrong, to move every
+    # record by the whole correction. See SleepMem.adjust_clock() for when
+    # the log can't be rebased.
+    print("current RTC time: ", now())
+    t = ask_time()
+    if not t:
+        return
+    old = time.time()
+    delta = mktime(t) - old
+    if not SleepMem().adjust_clock(delta, old, drift):
+        print("RTC NOT CHANGED (set_clock() starts a new log)")
+        return
+    RTC().datetime = t
+    print("new RTC time: ", now())
+    print("adjusted by %+d s, log rebased" % delta)
+
+def ask_time():
+    # Prompt for a date and time. Returns a struct_time, or None if the
+    # input was bad.
     print("Set RTC time...")
     try:
         y    = int(input("   year: "))
@@ -60,15 +311,10 @@ def set_clock():
         h    = int(input("   hour: "))
         min_ = int(input(" minute: "))
         s    = int(input("seconds: "))
-        t = struct_time((y, mon, d, h, min_, s, 0, -1, -1))
-        rtc.datetime = t
-        print("new RTC time: ", now())
+        return struct_time((y, mon, d, h, min_, s, 0, -1, -1))
     except ValueError as e:
         print("ERROR Bad value:", e)
-    # Set epoch
-    sm = SleepMem()
-    sm.epoch = time.time()
-    print("new epoch is: ", sm.epoch)
+        return None
 
 def now():
     # Return ESP32-S3 RTC time formatted as a string